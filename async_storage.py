@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from metrics import span
+
+
+class AsyncStorage:
+    """
+    Асинхронная обёртка над Storage/SqliteStorage.
+    Все обращения к диску идут в отдельном пуле потоков, а не в event loop;
+    писатели дополнительно выстраиваются в очередь через asyncio.Lock,
+    чтобы не занимать потоки пула ожиданием блокировки хранилища.
+    Пул можно передать общий (шарды групп), блокировка записи — своя у каждого.
+    """
+    def __init__(self, storage, max_workers: int = 2, executor: Optional[ThreadPoolExecutor] = None):
+        self.sync = storage
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+        self._write_lock = asyncio.Lock()
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        with span(f"storage.{fn.__name__}"):
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def _write(self, fn, *args, **kwargs):
+        async with self._write_lock:
+            return await self._run(fn, *args, **kwargs)
+
+    async def close(self):
+        compact = getattr(self.sync, "compact", None)
+        if compact is not None:
+            await self._write(compact)
+        close = getattr(self.sync, "close", None)
+        if close is not None:
+            await self._write(close)
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+
+    async def get_revision(self) -> Hashable:
+        return await self._run(self.sync.get_revision)
+
+    # --- Пользователи ---
+    async def is_registered(self, tg_id: int) -> bool:
+        return await self._run(self.sync.is_registered, tg_id)
+
+    async def get_user_key_by_tg(self, tg_id: int) -> Optional[str]:
+        return await self._run(self.sync.get_user_key_by_tg, tg_id)
+
+    async def register(self, user_key: str, tg_id: int) -> Tuple[bool, str]:
+        return await self._write(self.sync.register, user_key, tg_id)
+
+    async def get_registered_users(self) -> Dict[str, Dict]:
+        return await self._run(self.sync.get_registered_users)
+
+    async def set_reminder(self, user_key: str, remind_at: Optional[str], tz: Optional[str]) -> None:
+        await self._write(self.sync.set_reminder, user_key, remind_at, tz)
+
+    # --- Вес ---
+    async def add_weight(self, user_key: str, weight: float, on_date: Optional[str] = None) -> Tuple[bool, str]:
+        return await self._write(self.sync.add_weight, user_key, weight, on_date=on_date)
+
+    async def get_all_weights(self) -> List[dict]:
+        return await self._run(self.sync.get_all_weights)
+
+    async def get_start_date(self) -> str:
+        return await self._run(self.sync.get_start_date)
+
+    async def get_user_series(self, user_key: str) -> List[dict]:
+        return await self._run(self.sync.get_user_series, user_key)
+
+    async def get_user_range(self, user_key: str, since: Optional[str] = None,
+                             until: Optional[str] = None) -> List[dict]:
+        return await self._run(self.sync.get_user_range, user_key, since, until)
+
+    async def get_record(self, record_id: int) -> Optional[dict]:
+        return await self._run(self.sync.get_record, record_id)
+
+    # --- Редактирование последних записей ---
+    async def get_user_last_entries(self, user_key: str, n: int = 4) -> List[Tuple[int, dict]]:
+        return await self._run(self.sync.get_user_last_entries, user_key, n)
+
+    async def update_weight(self, record_id: int, new_weight: float) -> None:
+        await self._write(self.sync.update_weight, record_id, new_weight)
+
+    async def get_day_entry(self, user_key: str, day_iso: str) -> Optional[Tuple[int, dict]]:
+        return await self._run(self.sync.get_day_entry, user_key, day_iso)
+
+    # --- Выгрузка ---
+    async def export(self, fmt: str = "csv", user_key: Optional[str] = None,
+                     since: Optional[str] = None, until: Optional[str] = None):
+        """(SpooledTemporaryFile, число записей) — файл собирается в пуле потоков, см. export.py."""
+        from export import spooled_export
+        return await self._run(spooled_export, self.sync, fmt, user_key, since, until)
+
+    # --- Статистика ---
+    async def get_user_stats(self, user_key: str, target: Optional[float] = None) -> dict:
+        return await self._run(self.sync.get_user_stats, user_key, target)
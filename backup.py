@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+Резервные копии данных бота и восстановление на момент времени.
+
+    python backup.py snapshot                  # снять копию сейчас (бот может работать)
+    python backup.py list
+    python backup.py prune
+    python backup.py restore --at 2026-10-18T12:00 --out restored/
+
+JSON-шард копируется без блокировок: data.json заменяется только атомарно, а журнал
+только дописывается, так что снимок плюс хвост журнала — согласованное состояние
+(если журнал свернули между двумя чтениями, читаем заново). Первая копия цепочки (base) —
+снимок с хвостом журнала, следующие (delta) — лишь новые записи журнала; всё в gzip.
+Записи журнала помнят время (ts), поэтому восстановить можно любой момент, а не только
+моменты копий. SQLite-шарды копируются целиком через online backup API. Неизменившийся
+шард (та же ревизия SQLite, те же отметки файлов JSON) не копируется и даже не читается,
+реестр групп — тоже только когда изменился. Раскладка: BACKUP_DIR/main, BACKUP_DIR/groups/<gid>, BACKUP_DIR/registry.
+"""
+import argparse
+import asyncio
+import fcntl
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from config import (
+    BACKUP_DIR, BACKUP_INTERVAL, BACKUP_FULL_EVERY, BACKUP_RETENTION_DAYS, BACKUP_KEEP_CHAINS,
+    DATA_PATH, SQLITE_PATH, GROUPS_DIR, GROUPS_PATH, STORAGE_BACKEND, TIMEZONE,
+)
+from storage import Storage, _atomic_write_text, _file_stamp
+from groups import read_registry
+
+log = logging.getLogger("backup")
+
+_EXT = {"base": "jsonl", "delta": "jsonl", "db": "sqlite3", "registry": "json"}
+_NAME = re.compile(r"^(base|delta|db|registry)-(\d{8}T\d{6}\.\d{3})Z-s(\d+)\.\w+\.gz$")
+_TS_FORMAT = "%Y%m%dT%H%M%S.%f"
+
+
+class BackupFile(NamedTuple):
+    path: Path
+    kind: str     # base | delta | db | registry
+    ts: float     # когда снята (unix time)
+    seq: int      # последняя учтённая запись журнала (для SQLite — ревизия БД)
+
+
+def _stamp(ts: float) -> str:
+    dt = datetime.fromtimestamp(ts, timezone.utc)
+    return dt.strftime("%Y%m%dT%H%M%S") + f".{dt.microsecond // 1000:03d}"
+
+
+def list_files(directory: Path) -> List[BackupFile]:
+    files = []
+    if directory.is_dir():
+        for p in directory.iterdir():
+            m = _NAME.match(p.name)
+            if m:
+                ts = datetime.strptime(m.group(2), _TS_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+                files.append(BackupFile(p, m.group(1), ts, int(m.group(3))))
+    files.sort(key=lambda f: (f.ts, f.path.name))
+    return files
+
+
+def _write_gz(directory: Path, kind: str, ts: float, seq: int, chunks: Iterable[bytes]) -> Path:
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{kind}-{_stamp(ts)}Z-s{seq}.{_EXT[kind]}.gz"
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+            for chunk in chunks:
+                gz.write(chunk)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def _jsonl(records: Iterable[dict]) -> Iterable[bytes]:
+    for rec in records:
+        yield (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _read_jsonl(path: Path) -> Iterable[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+# --- Снятие копий ---
+def read_consistent(path: Path, attempts: int = 5) -> Tuple[dict, List[dict]]:
+    """
+    Снимок data.json и записи журнала после него, не трогая блокировки Storage.
+    Если журнал свернули между чтениями (сменился файл снимка или в seq дыра) — читаем заново.
+    """
+    journal = path.with_name(path.stem + ".journal.jsonl")
+    for _ in range(attempts):
+        with path.open("rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            data = json.load(f)
+        seq = data.get("seq", 0)
+        entries = []
+        try:
+            text = journal.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            text = ""
+        for line in text.splitlines(keepends=True):
+            if not line.endswith("\n"):
+                break   # строку дописывают прямо сейчас
+            entry = json.loads(line)
+            if entry["seq"] > seq:
+                entries.append(entry)
+        contiguous = all(e["seq"] == seq + i for i, e in enumerate(entries, start=1))
+        if contiguous and os.stat(path).st_ino == inode:
+            return data, entries
+        time.sleep(0.05)
+    raise RuntimeError(f"Cannot read a consistent copy of {path}")
+
+
+def _chain(files: List[BackupFile]) -> List[BackupFile]:
+    """Текущая цепочка: последний base и delta после него."""
+    files = [f for f in files if f.kind in ("base", "delta")]
+    starts = [i for i, f in enumerate(files) if f.kind == "base"]
+    return files[starts[-1]:] if starts else []
+
+
+def snapshot_json(path: Path, directory: Path, now: float) -> Optional[Path]:
+    # отметки (inode, размер, mtime) снимка и журнала на момент прошлой копии: не менялись —
+    # шард даже не читаем, так что неизменные группы почти ничего не стоят.
+    # Берём их до чтения: изменение посреди чтения просто даст лишнее чтение в следующий раз
+    stamp_path = directory / ".stamp"
+    stamps = json.dumps([_file_stamp(path), _file_stamp(path.with_name(path.stem + ".journal.jsonl"))])
+    try:
+        if stamp_path.read_text(encoding="utf-8") == stamps:
+            return None
+    except FileNotFoundError:
+        pass
+    out = _snapshot_json(path, directory, now)
+    _atomic_write_text(stamp_path, stamps)
+    return out
+
+
+def _snapshot_json(path: Path, directory: Path, now: float) -> Optional[Path]:
+    data, entries = read_consistent(path)
+    start = data.get("seq", 0)
+    end = entries[-1]["seq"] if entries else start
+    chain = _chain(list_files(directory))
+    last = chain[-1].seq if chain else None
+    # last вне [start, end]: журнал успели свернуть дальше копии или данные восстанавливали —
+    # тогда новая base; записи, свёрнутые до неё, по отдельности уже не восстановить
+    continues = last is not None and start <= last <= end
+    if continues and last == end:
+        return None
+    if continues and len(chain) - 1 < BACKUP_FULL_EVERY:
+        return _write_gz(directory, "delta", now, end, _jsonl(e for e in entries if e["seq"] > last))
+    return _write_gz(directory, "base", now, end, _jsonl([data, *entries]))
+
+
+def _sqlite_revision(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0])
+
+
+def snapshot_sqlite(path: Path, directory: Path, now: float) -> Optional[Path]:
+    db_files = [f for f in list_files(directory) if f.kind == "db"]
+    if db_files:
+        # ревизия не менялась — базу не копируем вовсе
+        src = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            if _sqlite_revision(src) == db_files[-1].seq:
+                return None
+        finally:
+            src.close()
+    directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        copy = Path(tmp) / "copy.sqlite3"
+        src = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        dst = sqlite3.connect(str(copy))
+        try:
+            src.backup(dst)   # согласованная копия, писатели ждут только короткие шаги
+            revision = _sqlite_revision(dst)
+        finally:
+            dst.close()
+            src.close()
+        if db_files and db_files[-1].seq == revision:
+            return None
+
+        def chunks():
+            with copy.open("rb") as f:
+                while chunk := f.read(1 << 20):
+                    yield chunk
+        return _write_gz(directory, "db", now, revision, chunks())
+
+
+def snapshot_registry(path: Path, directory: Path, now: float) -> Optional[Path]:
+    if not path.exists():
+        return None
+    # снимок реестра вместе с его журналом — в копию идёт уже сведённый groups.json
+    data, _, _ = read_registry(path)
+    files = list_files(directory)
+    if files and files[-1].seq == data["seq"]:
+        return None
+    raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    return _write_gz(directory, "registry", now, data["seq"], [raw])
+
+
+def shard_paths(backend: str = STORAGE_BACKEND) -> dict:
+    """Каталог копий (относительно BACKUP_DIR) → файл шарда: основная группа и все из GROUPS_DIR."""
+    main, pattern = (SQLITE_PATH, "*.sqlite3") if backend == "sqlite" else (DATA_PATH, "*.json")
+    shards = {"main": Path(main)} if Path(main).exists() else {}
+    if GROUPS_DIR.is_dir():
+        for p in sorted(GROUPS_DIR.glob(pattern)):
+            shards[f"groups/{p.stem}"] = p
+    return shards
+
+
+@contextmanager
+def _exclusive(root: Path):
+    """Одна копия за раз, даже если бот и cron запустили её одновременно."""
+    root.mkdir(parents=True, exist_ok=True)
+    with (root / ".lock").open("w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def run_snapshot(root: Path = BACKUP_DIR, backend: str = STORAGE_BACKEND,
+                 now: Optional[float] = None) -> List[Path]:
+    """Снять копии всех шардов и реестра, затем применить срок хранения. Возвращает новые файлы."""
+    now = now or time.time()
+    started = time.perf_counter()
+    snapshot = snapshot_sqlite if backend == "sqlite" else snapshot_json
+    written = []
+    with _exclusive(root):
+        jobs = [(name, path, snapshot) for name, path in shard_paths(backend).items()]
+        jobs.append(("registry", Path(GROUPS_PATH), snapshot_registry))
+        for name, path, fn in jobs:
+            try:
+                out = fn(path, root / name, now)
+            except Exception:
+                log.exception("Backup of %s failed", path)
+                continue
+            if out is not None:
+                written.append(out)
+        removed = sum(prune(d, now) for d in backup_dirs(root))
+    size = sum(p.stat().st_size for p in written)
+    log.info("Backup: %d files (%d bytes) in %.0fms, %d pruned",
+             len(written), size, (time.perf_counter() - started) * 1000, removed)
+    return written
+
+
+def backup_dirs(root: Path = BACKUP_DIR) -> List[Path]:
+    dirs = [root / "main", root / "registry"]
+    if (root / "groups").is_dir():
+        dirs += sorted(p for p in (root / "groups").iterdir() if p.is_dir())
+    return [d for d in dirs if d.is_dir()]
+
+
+def prune(directory: Path, now: float) -> int:
+    """
+    Срок хранения: цепочка (base со своими delta; копия SQLite или реестра — сама по себе)
+    удаляется целиком, когда её последний файл старше BACKUP_RETENTION_DAYS.
+    Последние BACKUP_KEEP_CHAINS цепочек остаются в любом случае.
+    """
+    chains: List[List[BackupFile]] = []
+    for f in list_files(directory):
+        if f.kind == "delta" and chains and chains[-1][0].kind == "base":
+            chains[-1].append(f)
+        else:
+            chains.append([f])
+    cutoff = now - BACKUP_RETENTION_DAYS * 86400
+    removed = 0
+    for chain in chains[:-max(1, BACKUP_KEEP_CHAINS)]:
+        if chain[-1].ts < cutoff:
+            for f in chain:
+                f.path.unlink(missing_ok=True)
+                removed += 1
+    return removed
+
+
+# --- Восстановление ---
+def restore_json(files: List[BackupFile], at: float, target: Path) -> Optional[int]:
+    """Шард на момент at в target (data.json без журнала); seq восстановленного состояния или None."""
+    bases = [i for i, f in enumerate(files) if f.kind == "base" and f.ts <= at]
+    if not bases:
+        return None
+    data, entries = None, []
+    for n, f in enumerate(files[bases[-1]:]):
+        if n and f.kind != "delta":
+            break
+        past = False
+        for rec in _read_jsonl(f.path):
+            if data is None:
+                data = rec
+            elif rec.get("ts", f.ts) <= at:
+                entries.append(rec)
+            else:
+                past = True
+                break
+        if past:
+            break
+    target.parent.mkdir(parents=True, exist_ok=True)
+    _atomic_write_text(target, json.dumps(data, ensure_ascii=False, indent=2))
+    journal = target.with_name(target.stem + ".journal.jsonl")
+    _atomic_write_text(journal, "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries))
+    # проигрывание журнала — тем же кодом, что и при обычной загрузке
+    st = Storage(target)
+    seq = st._read()["seq"]
+    st.compact()
+    journal.unlink(missing_ok=True)
+    return seq
+
+
+def restore_file(files: List[BackupFile], kind: str, at: float, target: Path) -> Optional[int]:
+    """Последняя целая копия kind (db, registry) не позже at — распакованная в target."""
+    candidates = [f for f in files if f.kind == kind and f.ts <= at]
+    if not candidates:
+        return None
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(candidates[-1].path, "rb") as src, target.open("wb") as dst:
+        shutil.copyfileobj(src, dst)
+    return candidates[-1].seq
+
+
+def restore(at: float, out: Path, root: Path = BACKUP_DIR, backend: str = STORAGE_BACKEND) -> dict:
+    """
+    Состояние всех шардов и реестра на момент at в каталоге out — в той же раскладке,
+    что и data/ (data.json, groups/<gid>.json, groups.json). Живые данные не трогаются.
+    """
+    main = SQLITE_PATH if backend == "sqlite" else DATA_PATH
+    suffix = Path(main).suffix
+    restored = {}
+    for directory in backup_dirs(root):
+        name = directory.relative_to(root).as_posix()
+        files = list_files(directory)
+        if name == "registry":
+            target = out / Path(GROUPS_PATH).name
+            seq = restore_file(files, "registry", at, target)
+        else:
+            target = out / (Path(main).name if name == "main" else name + suffix)
+            if backend == "sqlite":
+                seq = restore_file(files, "db", at, target)
+            else:
+                seq = restore_json(files, at, target)
+        if seq is None:
+            log.warning("No backup of %s at or before %s", name, _stamp(at))
+            continue
+        restored[name] = seq
+        log.info("Restored %s -> %s (seq %d)", name, target, seq)
+    return restored
+
+
+class BackupService:
+    """Копии из работающего бота: раз в interval run_snapshot в потоке, event loop диск не ждёт."""
+    def __init__(self, interval: float = BACKUP_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run(), name="backup")
+        log.info("Backups every %.0fs to %s", self.interval, BACKUP_DIR)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(run_snapshot)
+            except Exception:
+                log.exception("Backup failed")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _parse_at(value: str) -> float:
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TIMEZONE)
+    return dt.timestamp()
+
+
+def main():
+    from logging_conf import setup_logging
+
+    parser = argparse.ArgumentParser(description="Резервные копии WeightBot")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("snapshot", help="снять копию сейчас")
+    sub.add_parser("list", help="показать копии")
+    sub.add_parser("prune", help="удалить копии старше срока хранения")
+    p_restore = sub.add_parser("restore", help="восстановить на момент времени в отдельный каталог")
+    p_restore.add_argument("--at", type=_parse_at, default=None,
+                           help="ISO-время (без пояса — в TZ бота); по умолчанию последнее состояние")
+    p_restore.add_argument("--out", type=Path, required=True)
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.cmd == "snapshot":
+        for path in run_snapshot():
+            print(path)
+    elif args.cmd == "list":
+        for directory in backup_dirs():
+            print(f"{directory.relative_to(BACKUP_DIR).as_posix()}:")
+            for f in list_files(directory):
+                when = datetime.fromtimestamp(f.ts, TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"  {when}  {f.kind:8} seq={f.seq:<8} {f.path.stat().st_size:>10} B")
+    elif args.cmd == "prune":
+        with _exclusive(BACKUP_DIR):
+            removed = sum(prune(d, time.time()) for d in backup_dirs())
+        print(f"{removed} files removed")
+    else:
+        if args.out.exists() and any(args.out.iterdir()):
+            parser.error(f"{args.out} is not empty")
+        restored = restore(args.at or time.time(), args.out)
+        if not restored:
+            sys.exit("Nothing to restore")
+        for name, seq in restored.items():
+            print(f"{name}: seq {seq}")
+
+
+if __name__ == "__main__":
+    main()
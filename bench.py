@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Замеры производительности: хранилище, графики, меню, рассылка.
+
+    python bench.py [--sizes 10000,100000,1000000] [--users 100] [--backend json,sqlite]
+                    [--repeat 20] [--out bench-report.json] [--compare old-report.json]
+
+Данные генерируются во временном каталоге, рабочий data/ не трогается.
+Отчёт — плоский JSON {"имя замера": {"min_ms", "median_ms", ...}}, так что
+отчёты разных коммитов сравниваются через --compare (или обычным diff).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable, Dict
+
+from dotenv import load_dotenv
+load_dotenv()
+# с Telegram бенчмарк не общается, токен нужен только config.py
+os.environ.setdefault("BOT_TOKEN", "bench")
+
+from storage import Storage
+from storage_sqlite import SqliteStorage
+from migrate_to_sqlite import migrate
+from broadcast import Broadcaster
+
+log = logging.getLogger("bench")
+
+START = date(2000, 1, 1)
+
+
+def timed(fn: Callable[[int], object], repeat: int) -> Dict[str, float]:
+    """fn(i) вызывается repeat раз; времена в миллисекундах."""
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "min_ms": round(min(samples), 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "max_ms": round(max(samples), 4),
+        "n": repeat,
+    }
+
+
+def make_dataset(path: Path, n_records: int, n_users: int) -> Dict[str, str]:
+    """data.json на n_records записей: у каждого пользователя ежедневный ряд с START."""
+    roster = {f"u{i}": f"User {i}" for i in range(n_users)}
+    users = {k: {"telegram_id": 100_000 + i, "name": v} for i, (k, v) in enumerate(roster.items())}
+    # один участник без telegram_id — на нём замеряется register
+    roster["spare"] = "Spare"
+    users["spare"] = {"telegram_id": None, "name": "Spare"}
+    weights = []
+    per_user = -(-n_records // n_users)
+    for i in range(n_records):
+        user_no, day = divmod(i, per_user)
+        weights.append({
+            "id": i + 1,
+            "user_key": f"u{user_no}",
+            "date": (START + timedelta(days=day)).isoformat(),
+            "weight": round(90 - day * 0.01 + (i % 7) * 0.1, 1),
+        })
+    data = {"users": users, "weights": weights, "start_date": START.isoformat(), "seq": 0}
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return roster
+
+
+def bench_storage(report: dict, backend: str, size: int, n_users: int, repeat: int, workdir: Path):
+    json_path = workdir / f"data-{size}.json"
+    roster = make_dataset(json_path, size, n_users)
+    prefix = f"storage.{backend}.{size}"
+    per_user = -(-size // n_users)
+    last_day = (START + timedelta(days=per_user - 1)).isoformat()
+
+    if backend == "json":
+        def open_storage():
+            return Storage(json_path, roster)
+        cold = timed(lambda i: open_storage()._read(), min(repeat, 3))
+    else:
+        db_path = workdir / f"data-{size}.sqlite3"
+        started = time.perf_counter()
+        migrate(json_path, db_path)
+        report[f"{prefix}.migrate"] = {"min_ms": round((time.perf_counter() - started) * 1000, 4), "n": 1}
+
+        def open_storage():
+            return SqliteStorage(db_path, roster)
+        cold = timed(lambda i: open_storage().get_revision(), min(repeat, 3))
+    report[f"{prefix}.cold_load"] = cold
+
+    st = open_storage()
+    st.get_start_date()   # прогрев кэша
+    reads = {
+        "is_registered": lambda i: st.is_registered(100_000 + i % n_users),
+        "get_user_key_by_tg": lambda i: st.get_user_key_by_tg(100_000 + i % n_users),
+        "get_registered_users": lambda i: st.get_registered_users(),
+        "get_start_date": lambda i: st.get_start_date(),
+        "get_all_weights": lambda i: st.get_all_weights(),
+        "get_user_series": lambda i: st.get_user_series(f"u{i % n_users}"),
+        "get_user_range": lambda i: st.get_user_range(f"u{i % n_users}", since=START.isoformat(), until=last_day),
+        "get_record": lambda i: st.get_record(1 + i * 7919 % size),
+        "get_user_last_entries": lambda i: st.get_user_last_entries(f"u{i % n_users}", n=4),
+        "get_day_entry": lambda i: st.get_day_entry(f"u{i % n_users}", last_day),
+        "get_revision": lambda i: st.get_revision(),
+        "get_user_stats": lambda i: st.get_user_stats(f"u{i % n_users}", 75.0),
+    }
+    for name, fn in reads.items():
+        report[f"{prefix}.{name}"] = timed(fn, repeat)
+
+    # записи: каждый вызов — новый день, чтобы не упереться в «одна запись в день»
+    first_free = START + timedelta(days=per_user + 1)
+    writes = {
+        "add_weight": lambda i: st.add_weight("u0", 80.0, on_date=(first_free + timedelta(days=i)).isoformat()),
+        "update_weight": lambda i: st.update_weight(1 + i * 7919 % size, 81.5),
+        "set_reminder": lambda i: st.set_reminder("u0", "07:30", None),
+    }
+    for name, fn in writes.items():
+        report[f"{prefix}.{name}"] = timed(fn, repeat)
+    report[f"{prefix}.register"] = timed(lambda i: st.register("spare", 999_999), 1)
+    if backend == "json":
+        report[f"{prefix}.compact"] = timed(lambda i: st.compact(), min(repeat, 3))
+    else:
+        st.close()
+
+
+def bench_charts(report: dict, lengths, repeat: int):
+    from charts import build_weight_chart
+    users = {"semen": "Семён", "sergeant": "Сержант"}
+    for days in lengths:
+        weights = [
+            {"user_key": key, "date": (START + timedelta(days=d)).isoformat(), "weight": 90 - d * 0.01 - k}
+            for d in range(days) for k, key in enumerate(users)
+        ]
+        report[f"chart.{days}d"] = timed(lambda i: build_weight_chart(weights, START.isoformat(), users),
+                                         max(1, repeat // 5))
+
+
+def bench_menu(report: dict, repeat: int):
+    from meals import catalog, _build_menu_text
+    days = [date(2025, 1, d) for d in range(1, 32)]
+
+    def cold(i):
+        catalog._stamps = None   # заставить перечитать и проверить файлы
+        catalog.refresh()
+        for d in days:
+            _build_menu_text(d)
+
+    report["menu.31_days.cold"] = timed(cold, max(1, repeat // 5))
+    report["menu.31_days.warm"] = timed(lambda i: [_build_menu_text(d) for d in days], repeat)
+
+
+class FakeBot:
+    """Заглушка Bot: send_message «ходит в сеть» latency секунд."""
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.sent = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+
+
+def bench_broadcast(report: dict, chats: int, latency: float, rate: float):
+    async def run():
+        bot = FakeBot(latency)
+        stats = await Broadcaster(bot, rate=rate, per_chat_interval=0).broadcast(range(chats), "Доброе утро!")
+        return stats
+
+    started = time.perf_counter()
+    stats = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    report[f"broadcast.{chats}_chats"] = {
+        "min_ms": round(elapsed * 1000, 4),
+        "n": 1,
+        "sent": stats.sent,
+        "msgs_per_s": round(stats.sent / elapsed, 1) if elapsed else None,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old: dict, new: dict):
+    """Медианы двух отчётов бок о бок; >1.00 — стало медленнее."""
+    print(f"{'benchmark':50} {'old ms':>12} {'new ms':>12} {'ratio':>7}")
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        o = old["results"][name].get("median_ms", old["results"][name].get("min_ms"))
+        n = new["results"][name].get("median_ms", new["results"][name].get("min_ms"))
+        ratio = f"{n / o:.2f}" if o else "—"
+        print(f"{name:50} {o:12.3f} {n:12.3f} {ratio:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки WeightBot")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="число записей веса, через запятую")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--backend", default="json,sqlite")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--chart-days", default="30,365,1825")
+    parser.add_argument("--broadcast-chats", type=int, default=1000)
+    parser.add_argument("--broadcast-latency", type=float, default=0.05, help="секунд на один send_message")
+    parser.add_argument("--broadcast-rate", type=float, default=1e9,
+                        help="лимит сообщений/с (по умолчанию без лимита — меряется накладной расход)")
+    parser.add_argument("--only", default="storage,chart,menu,broadcast")
+    parser.add_argument("--out", type=Path, default=Path("bench-report.json"))
+    parser.add_argument("--compare", type=Path, help="отчёт прошлого прогона для сравнения")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    only = set(args.only.split(","))
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="weightbot-bench-") as tmp:
+        if "storage" in only:
+            for size in (int(s) for s in args.sizes.split(",")):
+                for backend in args.backend.split(","):
+                    print(f"storage: {backend}, {size} records...", file=sys.stderr)
+                    bench_storage(results, backend, size, args.users, args.repeat, Path(tmp))
+    if "chart" in only:
+        print("charts...", file=sys.stderr)
+        bench_charts(results, [int(d) for d in args.chart_days.split(",")], args.repeat)
+    if "menu" in only:
+        print("menu...", file=sys.stderr)
+        bench_menu(results, args.repeat)
+    if "broadcast" in only:
+        print("broadcast...", file=sys.stderr)
+        bench_broadcast(results, args.broadcast_chats, args.broadcast_latency, args.broadcast_rate)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": {k: str(v) for k, v in vars(args).items()},
+        },
+        "results": results,
+    }
+    args.out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Report written to {args.out}", file=sys.stderr)
+    if args.compare:
+        compare(json.loads(args.compare.read_text(encoding="utf-8")), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,48 @@
 # -*- coding: utf-8 -*-
-from dotenv import load_dotenv
-load_dotenv()
+from startup import StartupReport, wait_for_promotion
+startup = StartupReport()
+
+with startup.step("import dotenv"):
+    from dotenv import load_dotenv
+    load_dotenv()
 import asyncio
-from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart, Command
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.context import FSMContext
+import html
+import importlib
+import signal
+import sys
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+with startup.step("import aiogram"):
+    from aiogram import Bot, Dispatcher, F
+    from aiogram.filters import CommandStart, Command
+    from aiogram.fsm.state import StatesGroup, State
+    from aiogram.fsm.context import FSMContext
+    from aiogram.types import Message, CallbackQuery, BufferedInputFile
+    from aiogram.enums import ParseMode
+    from aiogram.exceptions import TelegramBadRequest
+    from aiogram.client.default import DefaultBotProperties
 from datetime import datetime
-from aiogram.types import Message, CallbackQuery, FSInputFile
-from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties
-from config import BOT_TOKEN, USERS, TIMEZONE
+from typing import Optional
+from config import BOT_TOKEN, TIMEZONE, DEFAULT_GROUP, MAX_GROUP_SIZE, GROUPS_PER_USER, STARTUP_REPORT_PATH, LOOP_LAG_LIMIT
+from config import HTTP_HOST, HTTP_PORT, BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET
 from keyboards import registration_kb, main_menu_kb, edit_choose_kb
-from storage import Storage
-from charts import build_weight_chart
-from scheduler import setup_scheduler
+with startup.step("import storage"):
+    from groups import GroupRegistry, UserContext
+    from fsm_storage import SqliteFSMStorage
+# matplotlib живёт только в процессах ChartService, NumPy (nutrition) грузится в prewarm()
+from concurrent.futures.process import BrokenProcessPool
+from chart_service import ChartService, ChartCache, ChartBusy
+from loop_monitor import LoopMonitor
+from backup import BackupService
+from user_context import UserContextMiddleware
+from metrics import MetricsMiddleware, TelegramTimingMiddleware, span
+from web_server import build_app, attach_webhook, start_http, WebhookHandler
+with startup.step("import scheduler"):
+    from scheduler import setup_scheduler, parse_hhmm
 from logging_conf import setup_logging
-from meals import handle_what_to_eat_today, handle_what_to_eat_tomorrow
-
-setup_logging()
+from stats import format_stats
+from export import parse_args as parse_export_args, SpooledInputFile
+with startup.step("import meals"):
+    from meals import catalog, handle_what_to_eat_today, handle_what_to_eat_tomorrow
 
 import logging
 log = logging.getLogger("bot")
@@ -30,52 +53,134 @@ class WeightForm(StatesGroup):
     editing_wait_value = State()   # NEW
 
 
-storage = Storage()
+# Всё, что открывает файлы, пишет на диск или запускает потоки, создаётся в setup(), а не при импорте:
+# процессы пула ChartService (forkserver) заново импортируют этот модуль как __mp_main__.
+groups = None         # GroupRegistry
+chart_service = None  # ChartService
+chart_cache = None    # ChartCache
+loop_monitor = None   # LoopMonitor
+backups = None        # BackupService
+reminders = None      # ReminderScheduler, создаётся в on_startup
+
+
+def setup():
+    global groups, chart_service, chart_cache, loop_monitor, backups
+    startup.path = STARTUP_REPORT_PATH
+    setup_logging()
+    with startup.step("open groups"):
+        groups = GroupRegistry()
+    chart_service = ChartService()
+    chart_cache = ChartCache()
+    loop_monitor = LoopMonitor()
+    backups = BackupService()
 
 async def on_startup(bot: Bot):
+    global reminders
+    loop_monitor.start()
+    backups.start()
     log.info("Scheduler starting...")
-    setup_scheduler(bot, storage)
+    with startup.step("start scheduler"):
+        reminders = await setup_scheduler(bot, groups)
     log.info("Scheduler started")
+    # тяжёлое прогревается в фоне, когда polling уже идёт
+    asyncio.create_task(prewarm(), name="prewarm")
+    startup.mark_ready()
+
+
+async def prewarm():
+    """Пул процессов для графиков, каталог меню и NumPy — после старта, не задерживая его."""
+    try:
+        with startup.step("prewarm chart pool"):
+            await asyncio.to_thread(chart_service.start)
+        with startup.step("prewarm meals"):
+            catalog.refresh()
+        with startup.step("prewarm nutrition"):
+            await asyncio.to_thread(importlib.import_module, "nutrition")
+    except Exception:
+        log.exception("Prewarm failed")
 
 
 # --- Хэндлеры ---
-async def start_cmd(message: Message, state: FSMContext):
+async def start_cmd(message: Message, state: FSMContext, user_ctx: Optional[UserContext]):
     await state.clear()
     log.info("User %s hit /start", message.from_user.id)
-    if storage.is_registered(message.from_user.id):
-        user_key = storage.get_user_key_by_tg(message.from_user.id)
-        name = USERS.get(user_key, "Участник")
+    if user_ctx:
+        group_id, _, user_key = user_ctx
+        name = groups.get_group(group_id)["roster"].get(user_key, "Участник")
         await message.answer(
-            f"Привет, {name}! 👋\nГотов к замерам?",
+            f"Привет, {html.escape(name)}! 👋\nГотов к замерам?",
             reply_markup=main_menu_kb()
         )
     else:
+        main_group = groups.get_group(DEFAULT_GROUP)
         await message.answer(
-            "Этот бот — для дуэли по снижению веса между Семёном и Сержантом.\n"
-            "Выберите, кем вы являетесь для регистрации:",
-            reply_markup=registration_kb()
+            "Этот бот — для дуэлей по снижению веса.\n"
+            "Создать свою дуэль: /newgroup Имя1, Имя2\n"
+            "Присоединиться по коду: /join КОД\n\n"
+            f"Или выберите, кем вы являетесь в дуэли «{html.escape(main_group['title'])}»:",
+            reply_markup=registration_kb(DEFAULT_GROUP, main_group["roster"])
         )
 
 async def register_cb(call: CallbackQuery):
     await call.answer()
     if not call.data or ":" not in call.data:
         return
-    _, user_key = call.data.split(":", 1)
-    ok, msg = storage.register(user_key=user_key, tg_id=call.from_user.id)
+    parts = call.data.split(":")
+    if len(parts) == 2:   # кнопки, отправленные до появления групп
+        parts = ["register", DEFAULT_GROUP, parts[1]]
+    _, group_id, user_key = parts[:3]
+    ok, msg = await groups.join(group_id, user_key=user_key, tg_id=call.from_user.id)
+    msg = html.escape(msg)  # в ответе имя из /newgroup, а сообщения уходят с ParseMode.HTML
     if ok:
+        # роль могли выбрать повторно — напоминание ставим по сохранённым настройкам
+        st = await groups.shard(group_id)
+        info = (await st.get_registered_users()).get(user_key, {})
+        reminders.schedule(call.from_user.id, group_id, user_key, info.get("remind_at"), info.get("tz"))
         await call.message.edit_text(msg)
         await call.message.answer("Главное меню:", reply_markup=main_menu_kb())
     else:
         await call.message.answer(f"❗ {msg}")
 
-async def add_weight_entry(message: Message, state: FSMContext):
-    if not storage.is_registered(message.from_user.id):
-        await message.answer("Сначала зарегистрируйтесь: /start")
+# --- /newgroup Имя1, Имя2 и /join КОД ---
+async def newgroup_cmd(message: Message):
+    if groups.group_of(message.from_user.id):
+        await message.answer("Вы уже участвуете в дуэли.")
         return
+    parts = (message.text or "").split(maxsplit=1)
+    names = [n.strip() for n in parts[1].split(",")] if len(parts) == 2 else []
+    names = [n for n in names if n]
+    if not 2 <= len(names) <= MAX_GROUP_SIZE or any(len(n) > 32 for n in names):
+        await message.answer(f"Использование: /newgroup Имя1, Имя2 (от 2 до {MAX_GROUP_SIZE} участников)")
+        return
+    group_id = await groups.create_group(" vs ".join(names), names, owner=message.from_user.id)
+    if group_id is None:
+        await message.answer(f"Можно создать не больше {GROUPS_PER_USER} дуэлей.")
+        return
+    group = groups.get_group(group_id)
+    await message.answer(
+        f"Дуэль создана! Код для участников: <code>{group_id}</code>\n"
+        f"Они присоединяются командой /join {group_id}\n\n"
+        "Выберите, кем вы являетесь:",
+        reply_markup=registration_kb(group_id, group["roster"])
+    )
+
+async def join_cmd(message: Message):
+    parts = (message.text or "").split(maxsplit=1)
+    group = groups.get_group(parts[1].strip()) if len(parts) == 2 else None
+    if group is None:
+        await message.answer("Дуэль не найдена. Использование: /join КОД")
+        return
+    group_id = parts[1].strip()
+    await message.answer(
+        f"Дуэль «{html.escape(group['title'])}». Выберите, кем вы являетесь:",
+        reply_markup=registration_kb(group_id, group["roster"])
+    )
+
+async def add_weight_entry(message: Message, state: FSMContext):
     await state.set_state(WeightForm.waiting_for_weight)
     await message.answer("Введите вес в кг (например, 82.4):")
 
-async def weight_input(message: Message, state: FSMContext):
+async def weight_input(message: Message, state: FSMContext, user_ctx: UserContext):
     # вычисляем "сегодня" по МСК
     today_msk = datetime.now(TIMEZONE).date().isoformat()
 
@@ -88,9 +193,9 @@ async def weight_input(message: Message, state: FSMContext):
         await message.answer("Некорректное число. Пример: 82.4")
         return
 
-    user_key = storage.get_user_key_by_tg(message.from_user.id)
+    _, st, user_key = user_ctx
 
-    ok, msg = storage.add_weight(user_key, value, on_date=today_msk)
+    ok, msg = await st.add_weight(user_key, value, on_date=today_msk)
     if not ok:
         log.warning("Daily limit: user=%s %s", message.from_user.id, today_msk)
         await message.answer(f"❗ {msg}\nЕсли опечатались — используйте «✏️ Исправить последние записи».")
@@ -102,23 +207,42 @@ async def weight_input(message: Message, state: FSMContext):
     await message.answer(msg, reply_markup=main_menu_kb())
 
 
-async def show_results(message: Message):
-    if not storage.is_registered(message.from_user.id):
-        await message.answer("Сначала зарегистрируйтесь: /start")
-        log.info("Chart requested by user %s", message.from_user.id)
-        return
+async def show_results(message: Message, user_ctx: UserContext):
+    group_id, st, _ = user_ctx
 
-    img_path = build_weight_chart(storage.get_all_weights(), storage.get_start_date())
-    await message.answer_photo(
-        photo=FSInputFile(img_path),
+    # версия берётся до чтения данных: в кэш никогда не попадёт график старее своего ключа
+    revision = (group_id, await st.get_revision())
+    file_id = chart_cache.get(revision)
+    if file_id:
+        try:
+            await message.answer_photo(photo=file_id, caption="Ваши результаты 📈")
+            return
+        except TelegramBadRequest:
+            log.warning("Cached chart file_id rejected, re-rendering (rev=%s)", revision)
+            chart_cache.drop(revision)
+
+    try:
+        all_weights, start_date = await st.get_all_weights(), await st.get_start_date()
+        with span("chart.render"):
+            png = await chart_service.render(all_weights, start_date, groups.get_group(group_id)["roster"])
+    except ChartBusy:
+        log.warning("Chart queue is full, user=%s", message.from_user.id)
+        await message.answer("Сейчас строится слишком много графиков. Попробуйте через минуту.")
+        return
+    except (asyncio.TimeoutError, BrokenProcessPool) as e:
+        log.error("Chart rendering failed (%s), user=%s", type(e).__name__, message.from_user.id)
+        await message.answer("Не получилось построить график. Попробуйте ещё раз.")
+        return
+    sent = await message.answer_photo(
+        photo=BufferedInputFile(png, filename="weights.png"),
         caption="Ваши результаты 📈"
     )
+    if sent.photo:
+        chart_cache.put(revision, sent.photo[-1].file_id)
 
 # --- Быстрая команда /weight 82.4 ---
-async def weight_cmd(message: Message, state: FSMContext):
-    if not storage.is_registered(message.from_user.id):
-        await message.answer("Сначала зарегистрируйтесь: /start")
-        return
+async def weight_cmd(message: Message, state: FSMContext, user_ctx: UserContext):
+    _, st, user_key = user_ctx
 
     parts = (message.text or "").split(maxsplit=1)
     if len(parts) != 2:
@@ -135,8 +259,7 @@ async def weight_cmd(message: Message, state: FSMContext):
         return
 
     today_msk = datetime.now(TIMEZONE).date().isoformat()
-    user_key = storage.get_user_key_by_tg(message.from_user.id)
-    ok, msg = storage.add_weight(user_key, value, on_date=today_msk)
+    ok, msg = await st.add_weight(user_key, value, on_date=today_msk)
     if not ok:
         await message.answer(f"❗ {msg}\nЕсли опечатались — используйте «✏️ Исправить последние записи».")
         return
@@ -144,12 +267,9 @@ async def weight_cmd(message: Message, state: FSMContext):
     await state.clear()
     await message.answer(msg, reply_markup=main_menu_kb())
 
-async def open_edit_menu(message: Message, state: FSMContext):
-    if not storage.is_registered(message.from_user.id):
-        await message.answer("Сначала зарегистрируйтесь: /start")
-        return
-    user_key = storage.get_user_key_by_tg(message.from_user.id)
-    last_entries = storage.get_user_last_entries(user_key, n=4)
+async def open_edit_menu(message: Message, state: FSMContext, user_ctx: UserContext):
+    _, st, user_key = user_ctx
+    last_entries = await st.get_user_last_entries(user_key, n=4)
     if not last_entries:
         await message.answer("У вас пока нет записей для редактирования.")
         return
@@ -162,17 +282,21 @@ async def edit_pick_cb(call: CallbackQuery, state: FSMContext):
     await call.answer()
     if not call.data or ":" not in call.data:
         return
-    _, idx_str = call.data.split(":", 1)
+    _, id_str = call.data.split(":", 1)
     try:
-        global_index = int(idx_str)
+        record_id = int(id_str)
     except ValueError:
         return
     # Запомним, какую запись редактируем
-    await state.update_data(edit_global_index=global_index)
+    await state.update_data(edit_record_id=record_id)
     await state.set_state(WeightForm.editing_wait_value)
     await call.message.answer("Введите новое значение веса (кг), например 82.1:")
 
-async def edit_apply_value(message: Message, state: FSMContext):
+async def stale_edit_cb(call: CallbackQuery):
+    # кнопки до появления id записей несли индекс в общем списке — по нему уже не понять, что правят
+    await call.answer("Меню устарело. Откройте «✏️ Исправить последние записи» ещё раз.", show_alert=True)
+
+async def edit_apply_value(message: Message, state: FSMContext, user_ctx: UserContext):
     text = (message.text or "").replace(",", ".").strip()
     try:
         value = float(text)
@@ -183,40 +307,206 @@ async def edit_apply_value(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    global_index = data.get("edit_global_index")
-    if global_index is None:
+    record_id = data.get("edit_record_id")
+    if record_id is None:
+        await message.answer("Не могу найти выбранную запись. Откройте меню редактирования ещё раз.")
+        await state.clear()
+        return
+
+    _, st, user_key = user_ctx
+    rec = await st.get_record(record_id)
+    if rec is None or rec["user_key"] != user_key:
         await message.answer("Не могу найти выбранную запись. Откройте меню редактирования ещё раз.")
         await state.clear()
         return
 
-    storage.update_weight_by_index(global_index, value)
+    await st.update_weight(record_id, value)
     await state.clear()
     await message.answer("Готово! Запись обновлена. ✅", reply_markup=main_menu_kb())
 
 
+# --- /stats [цель] ---
+async def stats_cmd(message: Message, user_ctx: UserContext):
+    group_id, st, user_key = user_ctx
+
+    parts = (message.text or "").split(maxsplit=1)
+    target = None
+    if len(parts) == 2:
+        try:
+            target = float(parts[1].replace(",", ".").strip())
+            if target <= 0 or target > 500:
+                raise ValueError
+        except ValueError:
+            await message.answer("Использование: /stats или /stats 75 (целевой вес)")
+            return
+
+    summary = await st.get_user_stats(user_key, target)
+    name = groups.get_group(group_id)["roster"].get(user_key, "Участник")
+    await message.answer(format_stats(name, summary))
+
+
+# --- /export [csv|jsonl] [all] [с] [по] ---
+async def export_cmd(message: Message, user_ctx: UserContext):
+    group_id, st, user_key = user_ctx
+
+    try:
+        opts = parse_export_args((message.text or "").split()[1:])
+    except ValueError:
+        await message.answer(
+            "Использование: /export [csv|jsonl] [all] [2025-01-01] [2025-03-31]\n"
+            "all — все участники дуэли, даты — с и по (включительно)."
+        )
+        return
+
+    spool, count = await st.export(opts["fmt"], None if opts["all"] else user_key, opts["since"], opts["until"])
+    if not count:
+        spool.close()
+        await message.answer("За выбранный период записей нет.")
+        return
+    suffix = "all" if opts["all"] else user_key
+    try:
+        await message.answer_document(
+            SpooledInputFile(spool, filename=f"weights-{group_id}-{suffix}.{opts['fmt']}"),
+            caption=f"Выгрузка: {count} записей",
+        )
+    finally:
+        # read() закрывает файл сам, но до него отправка может и не дойти
+        spool.close()
+
+
+async def nutrition_cmd(message: Message):
+    # NumPy подгружается при первом /nutrition, если prewarm ещё не успел
+    from nutrition import handle_nutrition
+    await handle_nutrition(message)
+
+
+# --- /remind 07:30 [Europe/Berlin] | /remind off ---
+async def remind_cmd(message: Message, user_ctx: UserContext):
+    group_id, st, user_key = user_ctx
+
+    parts = (message.text or "").split()[1:]
+    if parts == ["off"]:
+        await st.set_reminder(user_key, "off", None)
+        reminders.unschedule(message.from_user.id)
+        await message.answer("Напоминания отключены.")
+        return
+    if not 1 <= len(parts) <= 2:
+        await message.answer("Использование: /remind 07:30 Europe/Moscow или /remind off")
+        return
+    try:
+        at = parse_hhmm(parts[0])
+        tz = parts[1] if len(parts) == 2 else None
+        if tz:
+            ZoneInfo(tz)
+    except (ValueError, ZoneInfoNotFoundError):
+        await message.answer("Не понял время или часовой пояс. Пример: /remind 07:30 Europe/Moscow")
+        return
+
+    remind_at = at.strftime("%H:%M")
+    await st.set_reminder(user_key, remind_at, tz)
+    reminders.schedule(message.from_user.id, group_id, user_key, remind_at, tz)
+    await message.answer(f"Буду напоминать в {remind_at} ({tz or TIMEZONE.key}). ⏰")
+
+
+# хэндлеры с этим флагом доступны только зарегистрированным (см. user_context.py)
+REGISTERED = {"registered": True}
+
+
 def register_routes(dp: Dispatcher):
     dp.message.register(start_cmd, CommandStart())
     dp.callback_query.register(register_cb, F.data.startswith("register:"))
+    dp.message.register(newgroup_cmd, Command("newgroup"))
+    dp.message.register(join_cmd, Command("join"))
 
-    dp.message.register(add_weight_entry, F.text == "➕ Внести вес")
-    dp.message.register(show_results,  F.text == "📈 Показать результаты")
-    dp.message.register(open_edit_menu, F.text == "✏️ Исправить последние записи")  # NEW
+    dp.message.register(add_weight_entry, F.text == "➕ Внести вес", flags=REGISTERED)
+    dp.message.register(show_results,  F.text == "📈 Показать результаты", flags=REGISTERED)
+    dp.message.register(open_edit_menu, F.text == "✏️ Исправить последние записи", flags=REGISTERED)  # NEW
     dp.message.register(handle_what_to_eat_today, F.text == "🍽 Что мне поесть сегодня?")
     dp.message.register(handle_what_to_eat_tomorrow, F.text == "🍽 Что мне поесть завтра?")
 
-    dp.callback_query.register(edit_pick_cb, F.data.startswith("editpick:"))  # NEW
-    dp.message.register(edit_apply_value, WeightForm.editing_wait_value)      # NEW
-
-    dp.message.register(weight_cmd, Command("weight"))
-    dp.message.register(weight_input, WeightForm.waiting_for_weight)
+    dp.callback_query.register(edit_pick_cb, F.data.startswith("editrec:"))
+    dp.callback_query.register(stale_edit_cb, F.data.startswith("editpick:"))
+    dp.message.register(edit_apply_value, WeightForm.editing_wait_value, flags=REGISTERED)  # NEW
+
+    dp.message.register(weight_cmd, Command("weight"), flags=REGISTERED)
+    dp.message.register(nutrition_cmd, Command("nutrition"))
+    dp.message.register(stats_cmd, Command("stats"), flags=REGISTERED)
+    dp.message.register(export_cmd, Command("export"), flags=REGISTERED)
+    dp.message.register(remind_cmd, Command("remind"), flags=REGISTERED)
+    dp.message.register(weight_input, WeightForm.waiting_for_weight, flags=REGISTERED)
+
+
+def health() -> dict:
+    return {
+        "ok": loop_monitor.lag < LOOP_LAG_LIMIT,
+        "mode": BOT_MODE,
+        "loop_lag": round(loop_monitor.lag, 4),
+        "max_loop_lag": round(loop_monitor.max_lag, 4),
+        "ready": startup.ready_at is not None,
+    }
+
+
+async def serve_webhook(dp: Dispatcher, bot: Bot, webhook: WebhookHandler):
+    """Работать на webhook до SIGINT/SIGTERM; жизненный цикл dp — как у start_polling."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await dp.emit_startup(bot=bot)
+    try:
+        await bot.set_webhook(
+            WEBHOOK_BASE_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        log.info("Webhook set: %s%s", WEBHOOK_BASE_URL, WEBHOOK_PATH)
+        await stop.wait()
+    finally:
+        # webhook не снимаем: пока бот перезапускается, Telegram копит апдейты и повторит доставку.
+        # Хранилища закрываются в emit_shutdown — до этого новых апдейтов не берём и ждём начатые
+        await webhook.drain()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
 
 
 async def main():
     bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=SqliteFSMStorage())
+    dp.update.outer_middleware(startup.first_update_middleware)
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+    dp.message.middleware(UserContextMiddleware(groups))
+    dp.callback_query.middleware(UserContextMiddleware(groups))
+    bot.session.middleware(TelegramTimingMiddleware())
     register_routes(dp)
+    app = build_app(health)
+    webhook = attach_webhook(app, dp, bot, WEBHOOK_PATH, WEBHOOK_SECRET) if BOT_MODE == "webhook" else None
+    http_runner = await start_http(app, HTTP_HOST, HTTP_PORT) if HTTP_PORT else None
     await on_startup(bot)
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await serve_webhook(dp, bot, webhook)
+        else:
+            await bot.delete_webhook()   # после работы на webhook getUpdates иначе не отдаёт апдейты
+            await dp.start_polling(bot)
+    finally:
+        if http_runner is not None:
+            await http_runner.cleanup()
+        await loop_monitor.stop()
+        await backups.stop()
+        if reminders is not None:
+            await reminders.stop()
+        chart_service.shutdown()
+        await groups.close()
 
 if __name__ == "__main__":
+    standby = "--standby" in sys.argv
+    if standby:
+        # резерв supervisor.py: импорты уже сделаны, данные открываются только после команды
+        if not wait_for_promotion():
+            sys.exit(0)
+        startup.restart_clock()
+    setup()
+    if standby:
+        log.info("Standby promoted")
     asyncio.run(main())
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable
+
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramNetworkError, TelegramServerError, TelegramAPIError,
+)
+
+from config import BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_PER_CHAT_INTERVAL, BROADCAST_MAX_RETRIES
+
+log = logging.getLogger("broadcast")
+
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0      # пользователь заблокировал бота
+    retries: int = 0
+    flood_waits: int = 0  # сколько раз Telegram ответил RetryAfter
+    duration: float = 0.0
+
+    def __str__(self):
+        return (f"total={self.total} sent={self.sent} failed={self.failed} blocked={self.blocked} "
+                f"retries={self.retries} flood_waits={self.flood_waits} duration={self.duration:.2f}s")
+
+
+class TokenBucket:
+    """Общий лимит скорости: rate сообщений в секунду, всплеск до capacity."""
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановить выдачу на seconds (после RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Broadcaster:
+    """
+    Рассылка с ограничениями Telegram: общий token bucket (~30 сообщений/с),
+    не чаще одного сообщения в чат за per_chat_interval, не больше concurrency
+    одновременных запросов. RetryAfter выдерживается и запрос повторяется.
+    От бота нужен только метод send_message, так что подходит и заглушка.
+    """
+    def __init__(self, bot, rate: float = BROADCAST_RATE, concurrency: int = BROADCAST_CONCURRENCY,
+                 per_chat_interval: float = BROADCAST_PER_CHAT_INTERVAL, max_retries: int = BROADCAST_MAX_RETRIES):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self._sem = asyncio.Semaphore(concurrency)
+        self._chat_next: Dict[int, float] = {}   # chat_id → когда в чат снова можно писать
+
+    async def _wait_chat(self, chat_id: int):
+        now = time.monotonic()
+        ready_at = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, ready_at) + self.per_chat_interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+    def _forget_idle_chats(self):
+        # прошедшие моменты ничего не ограничивают; без чистки словарь рос бы с каждым новым чатом.
+        # Целиком не очищаем: параллельные рассылки (волны напоминаний) ещё могут идти
+        now = time.monotonic()
+        for chat_id in [c for c, ready_at in self._chat_next.items() if ready_at <= now]:
+            del self._chat_next[chat_id]
+
+    async def send(self, chat_id: int, text: str, stats: BroadcastStats = None, **kwargs) -> bool:
+        stats = stats or BroadcastStats()
+        async with self._sem:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    stats.retries += 1
+                await self._wait_chat(chat_id)
+                await self.bucket.acquire()
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    stats.sent += 1
+                    return True
+                except TelegramRetryAfter as e:
+                    stats.flood_waits += 1
+                    log.warning("Flood limit for %s, retry after %ss", chat_id, e.retry_after)
+                    self.bucket.pause(e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+                except TelegramForbiddenError:
+                    stats.blocked += 1
+                    log.info("Chat %s blocked the bot", chat_id)
+                    return False
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    log.warning("Send to %s failed (attempt %d): %s", chat_id, attempt + 1, e)
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                except TelegramAPIError as e:
+                    log.error("Send to %s rejected: %s", chat_id, e)
+                    break
+                except Exception:
+                    log.exception("Send to %s failed", chat_id)
+                    break
+            stats.failed += 1
+            return False
+
+    async def broadcast(self, chat_ids: Iterable[int], text: str, **kwargs) -> BroadcastStats:
+        stats = BroadcastStats()
+        started = time.monotonic()
+        tasks = []
+        for chat_id in chat_ids:
+            stats.total += 1
+            tasks.append(asyncio.create_task(self.send(chat_id, text, stats, **kwargs)))
+        if tasks:
+            await asyncio.gather(*tasks)
+        self._forget_idle_chats()
+        stats.duration = time.monotonic() - started
+        log.info("Broadcast finished: %s", stats)
+        return stats
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Hashable, List, Optional
+
+from config import CHART_WORKERS, CHART_QUEUE_LIMIT, CHART_TIMEOUT, CHART_CACHE_SIZE, CHART_DEBUG_SAVE, CHARTS_DIR
+
+log = logging.getLogger("charts")
+
+
+class ChartBusy(Exception):
+    """Очередь на построение графиков переполнена."""
+
+
+def _warm_worker():
+    # matplotlib, шрифты и Agg грузятся один раз при старте процесса, а не на первом запросе
+    import charts  # noqa: F401
+
+
+def _ping() -> bool:
+    return True
+
+
+def _render(all_weights: List[dict], start_date_iso: str, users: Dict[str, str]) -> bytes:
+    from charts import build_weight_chart
+    save_to = None
+    if CHART_DEBUG_SAVE:
+        save_to = CHARTS_DIR / f"weights-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.png"
+    return build_weight_chart(all_weights, start_date_iso, users, save_to=save_to)
+
+
+class ChartService:
+    """
+    Построение графиков в пуле процессов, чтобы matplotlib не блокировал event loop.
+    Очередь ограничена: при переполнении сразу ChartBusy, на каждый график — таймаут.
+    Место в очереди освобождается, только когда процесс действительно закончил график
+    (после таймаута он ещё дорисовывает). Упавший процесс ломает пул — тогда пул пересоздаётся.
+    """
+    def __init__(self, workers: int = CHART_WORKERS, queue_limit: int = CHART_QUEUE_LIMIT,
+                 timeout: float = CHART_TIMEOUT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        # вызывается и из prewarm (в потоке), и из render — пул создаётся один раз
+        with self._start_lock:
+            if self._pool is None:
+                self._start()
+
+    def _start(self):
+        # forkserver: процессы порождаются из чистого сервера с уже импортированным charts,
+        # а не форком бота с его потоками и открытыми соединениями
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["charts"])
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_warm_worker)
+        # поднимаем все процессы сразу, чтобы первый пользователь не ждал холодного старта
+        for _ in range(self.workers):
+            self._pool.submit(_ping)
+        log.info("Chart pool started: %d workers", self.workers)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _discard(self, pool: ProcessPoolExecutor):
+        # следующий render поднимет новый пул; второй упавший запрос старый уже не трогает
+        with self._start_lock:
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _release(self, fut: Future):
+        # колбэк из потока пула, поэтому счётчик уменьшаем в event loop
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._dec)
+
+    def _dec(self):
+        self._pending -= 1
+
+    async def render(self, all_weights: List[dict], start_date_iso: str, users: Dict[str, str]) -> bytes:
+        """PNG-байты графика."""
+        loop = asyncio.get_running_loop()
+        if self._pool is None:
+            await loop.run_in_executor(None, self.start)
+        if self._pending >= self.queue_limit:
+            raise ChartBusy()
+        pool = self._pool
+        try:
+            fut = pool.submit(_render, all_weights, start_date_iso, users)
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+        self._loop = loop
+        self._pending += 1
+        fut.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout=self.timeout)
+        except BrokenProcessPool:
+            log.error("Chart worker died, restarting the pool")
+            self._discard(pool)
+            raise
+
+
+class ChartCache:
+    """
+    LRU: версия данных → file_id уже загруженного в Telegram графика.
+    Пока вес не менялся, график не перерисовывается и не загружается повторно.
+    """
+    def __init__(self, size: int = CHART_CACHE_SIZE):
+        self.size = size
+        self._items: "OrderedDict[Hashable, str]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        file_id = self._items.get(key)
+        if file_id is not None:
+            self._items.move_to_end(key)
+        return file_id
+
+    def put(self, key: Hashable, file_id: str):
+        self._items[key] = file_id
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def drop(self, key: Hashable):
+        self._items.pop(key, None)
@@ -1,45 +1,58 @@
+from io import BytesIO
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime
 import matplotlib
 matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
-from config import CHARTS_DIR, USERS
+from config import USERS
+from stats import ema_series
 
 import matplotlib.dates as mdates
 
-def build_weight_chart(all_weights: List[dict], start_date_iso: str) -> str:
-    out_dir = Path(CHARTS_DIR)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_path = out_dir / "weights.png"
-
-    series: Dict[str, Dict[str, float]] = {k: {} for k in USERS.keys()}
+def build_weight_chart(all_weights: List[dict], start_date_iso: str, users: Dict[str, str] = USERS,
+                       save_to: Optional[Path] = None) -> bytes:
+    """
+    Рисует график участников users (user_key → имя) и возвращает PNG в виде байтов.
+    Используется отдельный объект Figure, а не глобальное состояние pyplot,
+    так что построения не мешают друг другу. save_to — копия на диск для отладки.
+    """
+    series: Dict[str, Dict[str, float]] = {k: {} for k in users.keys()}
     for rec in all_weights:
-        series[rec["user_key"]][rec["date"]] = float(rec["weight"])
+        if rec["user_key"] in series:
+            series[rec["user_key"]][rec["date"]] = float(rec["weight"])
 
-    plt.figure(figsize=(9, 5), dpi=150)
-    for key, title in USERS.items():
+    fig = Figure(figsize=(9, 5), dpi=150)
+    ax = fig.add_subplot()
+    for key, title in users.items():
         if not series[key]:
             continue
         dates = sorted(series[key].keys())
         xs = [datetime.fromisoformat(d) for d in dates]
         ys = [series[key][d] for d in dates]
-        plt.plot(xs, ys, marker="o", label=title)
+        line, = ax.plot(xs, ys, marker="o", label=title)
+        if len(ys) > 2:
+            # сглаженный тренд тем же цветом
+            ax.plot(xs, ema_series(ys), linestyle="--", linewidth=1.2, color=line.get_color(), alpha=0.7)
 
-    plt.title("Динамика веса (с начала испытания)")
-    plt.xlabel("Дата")
-    plt.ylabel("Вес, кг")
-    plt.grid(True, linestyle="--", alpha=0.4)
-    plt.legend()
+    ax.set_title("Динамика веса (с начала испытания)")
+    ax.set_xlabel("Дата")
+    ax.set_ylabel("Вес, кг")
+    ax.grid(True, linestyle="--", alpha=0.4)
+    ax.legend()
 
     # Формат оси X
-    ax = plt.gca()
     ax.xaxis.set_major_formatter(mdates.DateFormatter("%d.%m.%Y"))
-    plt.xticks(rotation=45)
-
-    plt.tight_layout()
-    plt.savefig(out_path)
-    plt.close()
-    return str(out_path)
-
+    ax.tick_params(axis="x", labelrotation=45)
+
+    fig.tight_layout()
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    png = buf.getvalue()
+
+    if save_to is not None:
+        save_to = Path(save_to)
+        save_to.parent.mkdir(parents=True, exist_ok=True)
+        save_to.write_bytes(png)
+    return png
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import secrets
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
@@ -12,6 +13,8 @@ if not BOT_TOKEN:
 
 # часовой пояс: берём из TZ или по умолчанию МСК
 TIMEZONE = ZoneInfo(os.getenv("TZ", "Europe/Moscow"))
+# напоминание по умолчанию (в TIMEZONE), пока пользователь не задал своё через /remind
+DEFAULT_REMINDER_TIME = os.getenv("DEFAULT_REMINDER_TIME", "08:00")
 
 USERS = {
     "semen": "Семён",
@@ -19,9 +22,68 @@ USERS = {
 }
 
 DATA_PATH = BASE_DIR / "data" / "data.json"
+# группы (дуэли): реестр и шарды групп; основная группа (USERS) — это data.json
+GROUPS_PATH = DATA_DIR / "groups.json"
+GROUPS_DIR = DATA_DIR / "groups"
+DEFAULT_GROUP = "main"
+MAX_GROUP_SIZE = 10
+GROUPS_PER_USER = int(os.getenv("GROUPS_PER_USER", "3"))          # сколько дуэлей один человек может создать
+GROUPS_OPEN_SHARDS = int(os.getenv("GROUPS_OPEN_SHARDS", "64"))   # открытых шардов в памяти (LRU)
+GROUPS_SHARD_IDLE = float(os.getenv("GROUPS_SHARD_IDLE", "300"))  # закрывать шард не раньше, чем он простоял столько
+# состояния диалогов (FSM): переживают перезапуск, сбрасываются на диск пачкой раз в интервал
+FSM_PATH = DATA_DIR / "fsm.sqlite3"
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.3"))
+# отчёт о холодном старте (см. startup.py)
+STARTUP_REPORT_PATH = DATA_DIR / "startup.json"
+# сторож event loop (loop_monitor.py) и его heartbeat для supervisor.py
+HEARTBEAT_PATH = DATA_DIR / "heartbeat.json"
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "1"))
+LOOP_LAG_WARN = float(os.getenv("LOOP_LAG_WARN", "0.25"))        # с такой задержки loop — warning со стеком
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "30"))  # heartbeat старше — бот завис
+HEARTBEAT_GRACE = float(os.getenv("HEARTBEAT_GRACE", "60"))      # на холодный старт до первого heartbeat
+LOOP_LAG_LIMIT = float(os.getenv("LOOP_LAG_LIMIT", "5"))         # лаг выше этого дольше HEARTBEAT_TIMEOUT — тоже
+# supervisor.py: статистика перезапусков; CRASH_LOOP_MAX падений за CRASH_LOOP_WINDOW секунд — пауза с backoff
+SUPERVISOR_STATS_PATH = DATA_DIR / "supervisor.json"
+CRASH_LOOP_WINDOW = float(os.getenv("CRASH_LOOP_WINDOW", "300"))
+CRASH_LOOP_MAX = int(os.getenv("CRASH_LOOP_MAX", "3"))
+# HTTP-сервер (web_server.py): /health, /metrics и webhook; HTTP_PORT=0 — выключен (только для polling)
+HTTP_HOST = os.getenv("HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "8080"))
+# приём апдейтов: "polling" или "webhook" (за reverse proxy, который проксирует WEBHOOK_PATH на HTTP_PORT)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")   # например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# без явного секрета генерируется новый при каждом старте (webhook всё равно переустанавливается)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+if BOT_MODE == "webhook" and not (WEBHOOK_BASE_URL and HTTP_PORT):
+    raise RuntimeError("Для BOT_MODE=webhook нужны WEBHOOK_BASE_URL и HTTP_PORT.")
+# хранилище: "json" (data.json) или "sqlite" (data.sqlite3, см. migrate_to_sqlite.py)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_PATH = DATA_DIR / "data.sqlite3"
+# резервные копии (backup.py): полная копия и инкременты к ней, раз в BACKUP_INTERVAL секунд из бота (0 — выключено)
+BACKUP_DIR = Path(os.getenv("BACKUP_DIR", str(DATA_DIR / "backups")))
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "600"))
+BACKUP_FULL_EVERY = int(os.getenv("BACKUP_FULL_EVERY", "144"))           # инкрементов на одну полную копию
+BACKUP_RETENTION_DAYS = float(os.getenv("BACKUP_RETENTION_DAYS", "14"))
+BACKUP_KEEP_CHAINS = int(os.getenv("BACKUP_KEEP_CHAINS", "3"))           # столько полных копий живут дольше срока
 CHARTS_DIR = BASE_DIR / "charts"
+# сохранять копию каждого графика в CHARTS_DIR (только для отладки)
+CHART_DEBUG_SAVE = os.getenv("CHART_DEBUG_SAVE", "") == "1"
+# графики строятся в отдельных процессах (см. chart_service.py)
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_QUEUE_LIMIT = int(os.getenv("CHART_QUEUE_LIMIT", "8"))   # сколько запросов может ждать/строиться разом
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "20"))        # секунд на один график
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "64"))    # сколько file_id готовых графиков помнить
 BREAKFAST_FILE = DATA_DIR / "breakfast.json"
 LUNCH_FILE     = DATA_DIR / "lunch.json"
 DINNER_FILE    = DATA_DIR / "dinner.json"
 SNACK1_FILE    = DATA_DIR / "snack1.json"   # NEW
-SNACK2_FILE    = DATA_DIR / "snack2.json"   # NEW
\ No newline at end of file
+SNACK2_FILE    = DATA_DIR / "snack2.json"   # NEW
+# рассылки (broadcast.py): лимиты Telegram — ~30 сообщений/с всего и ~1/с в один чат
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "30"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_PER_CHAT_INTERVAL = 1.0
+BROADCAST_MAX_RETRIES = 3
+
+# порог калорийности для /nutrition
+NUTRITION_KCAL_LIMIT = float(os.getenv("NUTRITION_KCAL_LIMIT", "2300"))
@@ -101,6 +101,18 @@ if [ ! -f ".env" ]; then
   fi
 fi
 
+# --- Supervisor уже работает: перезапуск бота без простоя (SIGHUP → свежий резерв → подмена) ---
+# RESTART_SUPERVISOR=1 — перезапустить и сам supervisor (нужно, если менялся supervisor.py)
+if [ -f "supervisor.pid" ] && [ "${RESTART_SUPERVISOR:-0}" != "1" ]; then
+  SUP_PID="$(cat supervisor.pid || true)"
+  if [ -n "${SUP_PID}" ] && kill -0 "$SUP_PID" >/dev/null 2>&1; then
+    echo "[DEPLOY] Supervisor is running (PID=$SUP_PID), requesting zero-downtime restart..."
+    kill -HUP "$SUP_PID"
+    echo "[DEPLOY] ✅ Restart requested. Stats: data/supervisor.json"
+    exit 0
+  fi
+fi
+
 # --- Останавливаем старый фоновый запуск (если был) ---
 if [ -f "supervisor.pid" ]; then
   OLD_PID="$(cat supervisor.pid || true)"
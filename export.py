@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Выгрузка истории веса в CSV или JSONL.
+
+    python export.py [--group main] [--user semen] [--format csv|jsonl]
+                     [--since 2025-01-01] [--until 2025-03-31] [--out weights.csv]
+
+Без --user выгружаются все участники группы, без --out — в stdout.
+Записи идут потоком, пачками из хранилища: память не растёт с длиной истории.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+import tempfile
+from datetime import date
+from typing import IO, Iterable, Optional
+
+from aiogram.types import InputFile
+
+log = logging.getLogger("export")
+
+FORMATS = ("csv", "jsonl")
+COLUMNS = ("id", "user_key", "date", "weight")
+# до такого размера выгрузка держится в памяти, дальше — во временном файле
+SPOOL_MAX_MEMORY = 1_000_000
+
+
+def iter_lines(records: Iterable[dict], fmt: str) -> Iterable[str]:
+    """Строки файла выгрузки по одной на запись (для CSV — с заголовком)."""
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(COLUMNS)
+        for rec in records:
+            writer.writerow([rec[c] for c in COLUMNS])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    elif fmt == "jsonl":
+        for rec in records:
+            yield json.dumps({c: rec[c] for c in COLUMNS}, ensure_ascii=False) + "\n"
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+
+def write_export(storage, out: IO[bytes], fmt: str = "csv", user_key: Optional[str] = None,
+                 since: Optional[str] = None, until: Optional[str] = None) -> int:
+    """Пишет выгрузку в бинарный поток out; возвращает число записей."""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for rec in storage.iter_weights(user_key, since, until):
+            count += 1
+            yield rec
+
+    for line in iter_lines(counted(), fmt):
+        out.write(line.encode("utf-8"))
+    out.flush()
+    log.info("Exported %d weights (%s, user=%s, %s..%s)", count, fmt, user_key or "*", since, until)
+    return count
+
+
+def spooled_export(storage, fmt: str = "csv", user_key: Optional[str] = None,
+                   since: Optional[str] = None, until: Optional[str] = None):
+    """(SpooledTemporaryFile с выгрузкой, перемотанный в начало; число записей)."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, mode="w+b")
+    try:
+        count = write_export(storage, spool, fmt, user_key, since, until)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, count
+
+
+class SpooledInputFile(InputFile):
+    """Отправка выгрузки в Telegram кусками из временного файла; после отправки файл закрывается."""
+    def __init__(self, spool, filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.spool = spool
+
+    async def read(self, bot):
+        self.spool.seek(0)
+        try:
+            while chunk := self.spool.read(self.chunk_size):
+                yield chunk
+        finally:
+            self.spool.close()
+
+
+def parse_args(tokens) -> dict:
+    """
+    Аргументы /export: формат (csv|jsonl), "all" и до двух дат ISO (с, по).
+    ValueError при непонятном аргументе.
+    """
+    opts = {"fmt": "csv", "all": False, "since": None, "until": None}
+    dates = []
+    for tok in tokens:
+        tok = tok.lower()
+        if tok in FORMATS:
+            opts["fmt"] = tok
+        elif tok == "all":
+            opts["all"] = True
+        else:
+            dates.append(date.fromisoformat(tok).isoformat())
+    if len(dates) > 2:
+        raise ValueError("too many dates")
+    if dates:
+        opts["since"] = dates[0]
+    if len(dates) == 2:
+        opts["until"] = dates[1]
+    return opts
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    from config import DEFAULT_GROUP, GROUPS_PATH, USERS
+    from groups import read_registry
+    from storage import create_storage, shard_path
+    from logging_conf import setup_logging
+
+    parser = argparse.ArgumentParser(description="Выгрузка истории веса")
+    parser.add_argument("--group", default=DEFAULT_GROUP)
+    parser.add_argument("--user", help="user_key участника; по умолчанию все")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--since", type=date.fromisoformat)
+    parser.add_argument("--until", type=date.fromisoformat)
+    parser.add_argument("--out", help="файл; по умолчанию stdout")
+    args = parser.parse_args()
+    setup_logging()
+
+    # только читаем: без GroupRegistry (пул потоков, bootstrap groups.json) и без создания файлов
+    if args.group == DEFAULT_GROUP:
+        roster = USERS
+    else:
+        try:
+            registry, _, _ = read_registry(GROUPS_PATH)
+        except FileNotFoundError:
+            registry = {"groups": {}}
+        group = registry["groups"].get(args.group)
+        if group is None:
+            parser.error(f"unknown group {args.group}")
+        roster = group["roster"]
+    if not shard_path(args.group).exists():
+        parser.error(f"no data for group {args.group}")
+
+    storage = create_storage(args.group, roster)
+    since = args.since.isoformat() if args.since else None
+    until = args.until.isoformat() if args.until else None
+    try:
+        if args.out:
+            with open(args.out, "wb") as out:
+                write_export(storage, out, args.format, args.user, since, until)
+        else:
+            write_export(storage, sys.stdout.buffer, args.format, args.user, since, until)
+    finally:
+        if hasattr(storage, "close"):
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import FSM_PATH, FSM_FLUSH_INTERVAL
+
+log = logging.getLogger("fsm")
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(str(p) for p in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+    ))
+
+
+class SqliteFSMStorage(BaseStorage):
+    """
+    FSM-хранилище, переживающее перезапуск бота.
+    Все состояния живут в памяти (write-back кэш), изменённые ключи раз в
+    flush_interval секунд пишутся в SQLite одной транзакцией — без записи
+    на диск на каждый апдейт. При остановке несохранённое досбрасывается.
+    """
+    def __init__(self, path: Path = Path(FSM_PATH), flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL)")
+        self._states: Dict[str, Optional[str]] = {}
+        self._data: Dict[str, Dict[str, Any]] = {}
+        for k, state, data in self._conn.execute("SELECT key, state, data FROM fsm"):
+            self._states[k] = state
+            self._data[k] = json.loads(data)
+        self._dirty: Set[str] = set()
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        log.info("FSM storage loaded: %d keys", len(self._states))
+
+    def _touch(self, k: str):
+        self._dirty.add(k)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later(), name="fsm-flush")
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        # начатый сброс не прерываем даже из close(): его ключи уже вынуты из _dirty
+        await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """Записать все изменённые ключи одной транзакцией."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for k in dirty:
+                state, data = self._states.get(k), self._data.get(k) or {}
+                if state is None and not data:
+                    # пустые ключи не храним ни на диске, ни в памяти
+                    self._states.pop(k, None)
+                    self._data.pop(k, None)
+                    deletes.append((k,))
+                else:
+                    upserts.append((k, state, json.dumps(data, ensure_ascii=False)))
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, upserts, deletes)
+            except Exception:
+                self._dirty |= dirty   # попробуем в следующий раз
+                log.exception("FSM flush failed")
+
+    def _write(self, upserts, deletes):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO fsm(key, state, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                upserts,
+            )
+            self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = _key(key)
+        self._states[k] = state.state if isinstance(state, State) else state
+        self._touch(k)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._states.get(_key(key))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        k = _key(key)
+        self._data[k] = dict(data)
+        self._touch(k)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self._data.get(_key(key)) or {})
+
+    async def close(self) -> None:
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        # блокировка дождётся фонового сброса, если он уже пишет, и только потом — последний
+        await self.flush()
+        self._conn.close()
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from config import GROUPS_PATH, DEFAULT_GROUP, USERS, GROUPS_OPEN_SHARDS, GROUPS_SHARD_IDLE, GROUPS_PER_USER
+from storage import create_storage, _atomic_write_text
+from async_storage import AsyncStorage
+
+log = logging.getLogger("groups")
+
+
+class UserContext(NamedTuple):
+    """Кто прислал апдейт: группа, её хранилище и роль (user_key) в ней."""
+    group_id: str
+    storage: AsyncStorage
+    user_key: str
+
+
+def _journal_path(path: Path) -> Path:
+    return path.with_name(path.stem + ".journal.jsonl")
+
+
+def _apply(data: dict, entry: dict):
+    if entry["op"] == "group":
+        data["groups"][entry["group_id"]] = entry["group"]
+    elif entry["op"] == "member":
+        data["members"][str(entry["tg_id"])] = entry["group_id"]
+    else:
+        raise ValueError(f"Unknown registry op: {entry['op']}")
+    data["seq"] = entry["seq"]
+
+
+def read_registry(path: Path) -> Tuple[dict, int, Optional[int]]:
+    """
+    Снимок groups.json с журналом поверх → (реестр, сколько записей журнала сверх снимка,
+    длина журнала без недописанной последней строки или None). Файлы не меняет:
+    обрывок пропускается, обрезает его только пишущий (GroupRegistry._append).
+    """
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    data.setdefault("seq", 0)
+    replayed, torn_at = 0, None
+    journal = _journal_path(path)
+    if journal.exists():
+        lines = journal.read_text(encoding="utf-8").splitlines(keepends=True)
+        if lines and not lines[-1].endswith("\n"):
+            lines.pop()
+            torn_at = len("".join(lines).encode("utf-8"))
+        for line in lines:
+            entry = json.loads(line)
+            if entry["seq"] > data["seq"]:
+                _apply(data, entry)
+                replayed += 1
+    return data, replayed, torn_at
+
+
+class GroupRegistry:
+    """
+    Реестр групп (дуэлей) — data/groups.json:
+        {"groups": {gid: {"title", "roster": {user_key: имя}, "created", "owner"}},
+         "members": {telegram_id: gid}, "seq": n}
+    Как и в Storage, изменения дописываются в журнал groups.journal.jsonl, а снимок
+    переписывается раз в COMPACT_EVERY записей — регистрация не стоит O(всех участников).
+    Данные каждой группы лежат в своём шарде (см. storage.create_storage),
+    который открывается при первом обращении. Шарды пишутся независимо:
+    у каждого своя блокировка записи, общий только пул потоков.
+    Открытых шардов не больше max_open: давно простаивающие закрываются (LRU).
+    """
+    COMPACT_EVERY = 200
+
+    def __init__(self, path: Path = Path(GROUPS_PATH), max_workers: int = 4,
+                 max_open: int = GROUPS_OPEN_SHARDS, idle: float = GROUPS_SHARD_IDLE):
+        self.path = Path(path)
+        self.journal_path = _journal_path(self.path)
+        self.max_open = max_open
+        self.idle = idle
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+        self._shards: "OrderedDict[str, AsyncStorage]" = OrderedDict()
+        self._used: Dict[str, float] = {}      # group_id → когда шард брали в последний раз
+        self._opening: Dict[str, asyncio.Task] = {}  # шарды, которые сейчас открываются в пуле
+        self._user_keys: Dict[int, str] = {}   # telegram_id → user_key, сбрасывается в join
+        self._lock = asyncio.Lock()
+        self.reload()
+
+    def reload(self):
+        """Перечитать реестр с диска."""
+        if self.path.exists():
+            data, self._pending, self._torn_at = read_registry(self.path)
+            self.groups: Dict[str, dict] = data["groups"]
+            self.members: Dict[int, str] = {int(k): v for k, v in data["members"].items()}
+            self._seq = data["seq"]
+        else:
+            self._bootstrap()
+        self._created: Dict[int, int] = {}     # telegram_id → сколько групп создал
+        for group in self.groups.values():
+            if group.get("owner"):
+                self._created[group["owner"]] = self._created.get(group["owner"], 0) + 1
+        self._user_keys.clear()
+
+    def _bootstrap(self):
+        # первый запуск: основная группа — это прежний data.json с ролями из USERS
+        main = create_storage(DEFAULT_GROUP, USERS)
+        try:
+            created, registered = main.get_start_date(), main.get_registered_users()
+        finally:
+            if hasattr(main, "close"):
+                main.close()
+        self.groups = {DEFAULT_GROUP: {
+            "title": " vs ".join(USERS.values()),
+            "roster": dict(USERS),
+            "created": created,
+        }}
+        self.members = {int(u["telegram_id"]): DEFAULT_GROUP for u in registered.values()}
+        self._seq, self._pending, self._torn_at = 0, 0, None
+        self._save()
+        log.info("Group registry created with %d members of the main group", len(self.members))
+
+    def _save(self):
+        """Новый снимок; журнал после него пуст (его записи с seq <= снимка и так пропускаются)."""
+        data = {
+            "groups": self.groups,
+            "members": {str(k): v for k, v in self.members.items()},
+            "seq": self._seq,
+        }
+        _atomic_write_text(self.path, json.dumps(data, ensure_ascii=False, indent=2))
+        _atomic_write_text(self.journal_path, "")
+        self._pending, self._torn_at = 0, None
+
+    def _append(self, entry: dict):
+        with self.journal_path.open("a", encoding="utf-8") as f:
+            if self._torn_at is not None:
+                log.warning("Dropping torn journal tail in %s", self.journal_path)
+                f.truncate(self._torn_at)
+                self._torn_at = None
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _record(self, entry: dict):
+        """Записать изменение (уже применённое в памяти) в журнал; вызывается под self._lock."""
+        self._seq += 1
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._append, {"seq": self._seq, **entry})
+        self._pending += 1
+        if self._pending >= self.COMPACT_EVERY:
+            await loop.run_in_executor(self._executor, self._save)
+
+    # --- Группы ---
+    def get_group(self, group_id: str) -> Optional[dict]:
+        return self.groups.get(group_id)
+
+    def group_of(self, tg_id: int) -> Optional[str]:
+        return self.members.get(tg_id)
+
+    async def resolve(self, tg_id: int) -> Optional[UserContext]:
+        """
+        Контекст зарегистрированного пользователя или None.
+        user_key запоминается: повторные апдейты не ходят в хранилище.
+        """
+        group_id = self.members.get(tg_id)
+        if group_id is None:
+            return None
+        st = await self.shard(group_id)
+        user_key = self._user_keys.get(tg_id)
+        if user_key is None:
+            user_key = await st.get_user_key_by_tg(tg_id)
+            if user_key is None:
+                return None
+            self._user_keys[tg_id] = user_key
+        return UserContext(group_id, st, user_key)
+
+    async def shard(self, group_id: str) -> AsyncStorage:
+        """Хранилище группы; открывается лениво, давно не нужные закрываются (см. _evict)."""
+        st = self._shards.get(group_id)
+        if st is None:
+            task = self._opening.get(group_id)
+            if task is None:
+                task = asyncio.ensure_future(self._open(group_id))
+                self._opening[group_id] = task
+                task.add_done_callback(lambda _: self._opening.pop(group_id, None))
+            # shield: отмена одного апдейта не должна обрывать открытие для остальных
+            st = await asyncio.shield(task)
+        else:
+            self._shards.move_to_end(group_id)
+        self._used[group_id] = time.monotonic()
+        return st
+
+    async def _open(self, group_id: str) -> AsyncStorage:
+        # конструктор хранилища ходит на диск (SQLite: подключение и DDL, JSON: начальный файл)
+        roster = self.groups[group_id]["roster"]
+        loop = asyncio.get_running_loop()
+        storage = await loop.run_in_executor(self._executor, create_storage, group_id, roster)
+        st = AsyncStorage(storage, executor=self._executor)
+        self._shards[group_id] = st
+        self._used[group_id] = time.monotonic()
+        self._evict(keep=group_id)
+        return st
+
+    def _evict(self, keep: str):
+        # закрываем самые старые, но только простоявшие idle секунд: хэндлер держит шард
+        # лишь на время одного апдейта, так что закрытый шард уже никто не использует;
+        # keep — шард, который прямо сейчас отдаём вызывающему
+        now = time.monotonic()
+        for group_id in list(self._shards):
+            if len(self._shards) <= self.max_open:
+                break
+            if group_id in (DEFAULT_GROUP, keep) or now - self._used.get(group_id, 0) < self.idle:
+                continue
+            st = self._shards.pop(group_id)
+            self._used.pop(group_id, None)
+            close = getattr(st.sync, "close", None)
+            if close is not None:
+                self._executor.submit(close)
+            log.info("Shard %s closed (idle), %d open", group_id, len(self._shards))
+
+    async def registered_users(self, group_id: str) -> Dict[str, Dict]:
+        """
+        Зарегистрированные участники группы. Закрытый шард открывается только
+        на время чтения и не занимает место среди открытых (для обхода всех групп).
+        """
+        st = self._shards.get(group_id)
+        if st is not None:
+            return await st.get_registered_users()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._read_users, group_id)
+
+    def _read_users(self, group_id: str) -> Dict[str, Dict]:
+        storage = create_storage(group_id, self.groups[group_id]["roster"])
+        try:
+            return storage.get_registered_users()
+        finally:
+            if hasattr(storage, "close"):
+                storage.close()
+
+    async def create_group(self, title: str, names: List[str], owner: Optional[int] = None) -> Optional[str]:
+        """Код новой группы или None, если owner уже создал GROUPS_PER_USER групп."""
+        roster = {f"p{i}": name for i, name in enumerate(names, start=1)}
+        async with self._lock:
+            if owner is not None and self._created.get(owner, 0) >= GROUPS_PER_USER:
+                return None
+            group_id = secrets.token_hex(3)
+            while group_id in self.groups:
+                group_id = secrets.token_hex(3)
+            group = {"title": title, "roster": roster, "created": date.today().isoformat(), "owner": owner}
+            self.groups[group_id] = group
+            if owner is not None:
+                self._created[owner] = self._created.get(owner, 0) + 1
+            await self._record({"op": "group", "group_id": group_id, "group": group})
+        log.info("Group %s created: %s", group_id, title)
+        return group_id
+
+    async def join(self, group_id: str, user_key: str, tg_id: int) -> Tuple[bool, str]:
+        """Регистрация участника в роли user_key группы group_id."""
+        if group_id not in self.groups:
+            return False, "Такой группы нет."
+        # проверка и регистрация — под одной блокировкой: два параллельных /join
+        # не должны записать одного человека в два шарда
+        async with self._lock:
+            current = self.members.get(tg_id)
+            if current and current != group_id:
+                return False, "Вы уже участвуете в другой дуэли."
+            st = await self.shard(group_id)
+            ok, msg = await st.register(user_key=user_key, tg_id=tg_id)
+            self._user_keys.pop(tg_id, None)
+            if ok and current != group_id:
+                self.members[tg_id] = group_id
+                await self._record({"op": "member", "tg_id": tg_id, "group_id": group_id})
+        return ok, msg
+
+    def iter_members(self) -> Iterator[Tuple[int, str]]:
+        """Пары (telegram_id, group_id) всех зарегистрированных."""
+        return iter(list(self.members.items()))
+
+    async def close(self):
+        for st in self._shards.values():
+            await st.close()
+        self._executor.shutdown(wait=True)
@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from datetime import datetime
-from config import USERS
+from typing import Dict
 
-def registration_kb() -> InlineKeyboardMarkup:
+def registration_kb(group_id: str, roster: Dict[str, str]) -> InlineKeyboardMarkup:
     buttons = [
-        [InlineKeyboardButton(text=f"Зарегистрироваться как {title}", callback_data=f"register:{key}")]
-        for key, title in USERS.items()
+        [InlineKeyboardButton(text=f"Зарегистрироваться как {title}", callback_data=f"register:{group_id}:{key}")]
+        for key, title in roster.items()
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
@@ -24,11 +24,11 @@ def main_menu_kb() -> ReplyKeyboardMarkup:
 
 def edit_choose_kb(entries: list) -> InlineKeyboardMarkup:
     rows = []
-    for idx, rec in entries:
+    for record_id, rec in entries:
         # форматируем дату в ДД.ММ.ГГГГ
         dt_str = datetime.fromisoformat(rec["date"]).strftime("%d.%m.%Y")
         text = f"{dt_str} — {rec['weight']} кг"
-        rows.append([InlineKeyboardButton(text=text, callback_data=f"editpick:{idx}")])
+        rows.append([InlineKeyboardButton(text=text, callback_data=f"editrec:{record_id}")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
@@ -1,26 +1,95 @@
 # -*- coding: utf-8 -*-
+import atexit
+import contextvars
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
+from typing import Optional
 
 LOG_FILE = Path("bot.log")
+# "text" — как раньше, "json" — по объекту JSON на строку (дешевле разбирать при большом объёме)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
-def setup_logging(level=logging.INFO):
+# поля текущего апдейта (update_id, user_id, handler) — выставляет MetricsMiddleware
+log_context: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+CONTEXT_FIELDS = ("update_id", "user_id", "handler", "latency_ms")
+
+_listener: Optional[QueueListener] = None
+
+
+class ContextFilter(logging.Filter):
+    """Переносит поля апдейта из contextvars в запись (в потоке, который логирует)."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # в вызывающем потоке только подставляем args; форматирование,
+        # трейсбеки и запись на диск — в потоке QueueListener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(level=None):
+    """
+    Корневой логгер пишет только в очередь; консоль и ротируемый файл
+    обслуживает QueueListener в своём потоке, так что event loop не ждёт диск.
+    Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    level = level or LOG_LEVEL
     LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
     fmt = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
     datefmt = "%Y-%m-%d %H:%M:%S"
-
-    logger = logging.getLogger()
-    logger.setLevel(level)
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(fmt=fmt, datefmt=datefmt)
 
     # Консоль
     ch = logging.StreamHandler()
-    ch.setLevel(level)
-    ch.setFormatter(logging.Formatter(fmt=fmt, datefmt=datefmt))
-    logger.addHandler(ch)
+    ch.setFormatter(formatter)
 
     # Ротация файла (до 5 файлов по 2 МБ)
     fh = RotatingFileHandler(LOG_FILE, maxBytes=2_000_000, backupCount=5, encoding="utf-8")
-    fh.setLevel(level)
-    fh.setFormatter(logging.Formatter(fmt=fmt, datefmt=datefmt))
-    logger.addHandler(fh)
+    fh.setFormatter(formatter)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    qh = _QueueHandler(log_queue)
+    qh.addFilter(ContextFilter())
+
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    logger.addHandler(qh)
+
+    _listener = QueueListener(log_queue, ch, fh)
+    _listener.start()
+    # при выходе дописать всё, что ещё в очереди
+    atexit.register(_listener.stop)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Optional
+
+from metrics import LOOP_LAG
+from config import HEARTBEAT_PATH, HEARTBEAT_INTERVAL, LOOP_LAG_WARN
+
+log = logging.getLogger("loop")
+
+
+class LoopMonitor:
+    """
+    Сторож event loop.
+    Корутина раз в interval замеряет задержку планирования (насколько позже
+    положенного проснулся asyncio.sleep) и пишет heartbeat-файл — по нему
+    supervisor.py узнаёт зависший бот. Отдельный поток следит, не застрял ли
+    loop дольше lag_warn, и логирует стек, на котором он стоит: так видно,
+    какой синхронный вызов его держит.
+    """
+    def __init__(self, path: Path = Path(HEARTBEAT_PATH), interval: float = HEARTBEAT_INTERVAL,
+                 lag_warn: float = LOOP_LAG_WARN):
+        self.path = Path(path)
+        self.interval = interval
+        self.lag_warn = lag_warn
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._last_tick = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._beat()
+        self._task = asyncio.create_task(self._run(), name="loop-monitor")
+        self._thread = threading.Thread(target=self._watch, name="loop-watch", daemon=True)
+        self._thread.start()
+        log.info("Loop monitor started: heartbeat %s every %.1fs", self.path, self.interval)
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - expected)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG.set(self.lag)
+            self._last_tick = time.monotonic()
+            if self.lag > self.lag_warn:
+                log.warning("Event loop lag %.3fs", self.lag)
+            try:
+                self._beat()
+            except OSError as e:
+                log.warning("Cannot write heartbeat: %s", e)
+
+    def _beat(self):
+        # маленький файл без fsync: важна свежесть, а не сохранность
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({
+            "pid": os.getpid(), "ts": time.time(), "lag": round(self.lag, 4), "max_lag": round(self.max_lag, 4),
+        }), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._last_tick - self.interval
+            if stalled <= self.lag_warn:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True   # один стек на один эпизод блокировки
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unknown>"
+            log.warning("Event loop blocked for %.1fs at:\n%s", stalled, stack)
@@ -1,12 +1,28 @@
 import json
+import logging
+import os
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from aiogram.types import Message
 
+from metrics import span
 from config import TIMEZONE, BREAKFAST_FILE, LUNCH_FILE, DINNER_FILE, SNACK1_FILE, SNACK2_FILE
 
+log = logging.getLogger("meals")
+
+# приёмы пищи в порядке вывода: (ключ, файл, заголовок, эмодзи)
+MEAL_SLOTS = (
+    ("breakfast", BREAKFAST_FILE, "Завтрак", "☕️"),
+    ("snack1", SNACK1_FILE, "Перекус 1", "🥪"),
+    ("lunch", LUNCH_FILE, "Обед", "🍲"),
+    ("snack2", SNACK2_FILE, "Полдник", "🍎"),
+    ("dinner", DINNER_FILE, "Ужин", "🍛"),
+)
+MACROS = ("kcal", "protein_g", "fat_g", "carbs_g")
+DAYS_IN_CYCLE = 31  # номер дня берётся из числа месяца
+
 
 # ---------- helpers ----------
 def _load_json(path: Path) -> list[dict]:
@@ -96,26 +112,22 @@ def _format_simple_meal(meal: dict) -> str:
     return "\n".join(f" • {p}" for p in parts) if parts else "—"
 
 
-def _format_meal_block(title: str, emoji: str, meal: dict) -> tuple[str, Optional[dict]]:
+def _format_meal_block(title: str, emoji: str, meal: dict, totals: Optional[dict]) -> str:
     day_no = meal.get("day", "?")
     items = meal.get("items")
     if isinstance(items, list) and items:
         lines = "\n".join(_format_item_line(it) for it in items)
-        totals = _meal_totals_or_recalc(meal)
         totals_txt = ""
         if totals:
             totals_txt = (
                 f"\n<i>Итого:</i> "
-                f"{_fmt_kcal(_num(totals.get('kcal')))}, "
-                f"Б {_fmt_g_macro(_num(totals.get('protein_g')))}, "
-                f"Ж {_fmt_g_macro(_num(totals.get('fat_g')))}, "
-                f"У {_fmt_g_macro(_num(totals.get('carbs_g')))}"
+                f"{_fmt_kcal(totals['kcal'])}, "
+                f"Б {_fmt_g_macro(totals['protein_g'])}, "
+                f"Ж {_fmt_g_macro(totals['fat_g'])}, "
+                f"У {_fmt_g_macro(totals['carbs_g'])}"
             )
-        block = f"{emoji} <b>{title}</b> (№{day_no})\n{lines}{totals_txt}"
-        return block, totals
-    else:
-        block = f"{emoji} <b>{title}</b> (№{day_no})\n{_format_simple_meal(meal)}"
-        return block, None
+        return f"{emoji} <b>{title}</b> (№{day_no})\n{lines}{totals_txt}"
+    return f"{emoji} <b>{title}</b> (№{day_no})\n{_format_simple_meal(meal)}"
 
 
 def _pick_by_day(meals: list[dict], day_num: int) -> dict:
@@ -125,54 +137,122 @@ def _pick_by_day(meals: list[dict], day_num: int) -> dict:
     return meals[idx]
 
 
+def _normalize_totals(totals: Optional[dict]) -> Optional[dict]:
+    if not totals:
+        return None
+    return {m: _num(totals.get(m)) for m in MACROS}
+
+
+def _validate(slot: str, meals) -> List[dict]:
+    if not isinstance(meals, list):
+        raise ValueError(f"{slot}: ожидается список приёмов пищи")
+    for i, meal in enumerate(meals):
+        if not isinstance(meal, dict):
+            raise ValueError(f"{slot}[{i}]: ожидается объект")
+        items = meal.get("items")
+        if items is not None and not (isinstance(items, list) and all(isinstance(it, dict) for it in items)):
+            raise ValueError(f"{slot}[{i}].items: ожидается список объектов")
+    return meals
+
+
+class MealCatalog:
+    """
+    Меню, загруженное в память один раз.
+    Итоги по приёмам пищи и по дням считаются при загрузке, готовый текст
+    каждого из 31 дня кэшируется. Если какой-то из файлов изменился (mtime),
+    каталог целиком перечитывается и подменяется; при ошибке в новых файлах
+    продолжаем работать со старой версией.
+    """
+    def __init__(self, slots=MEAL_SLOTS):
+        self.slots = slots
+        self.version = 0
+        self._stamps: Optional[Tuple] = None
+        self.meals: Dict[str, List[dict]] = {}
+        self.meal_totals: Dict[str, List[Optional[dict]]] = {}
+        self.day_totals: Dict[int, Optional[dict]] = {}
+        self._rendered: Dict[int, str] = {}
+
+    def _file_stamps(self) -> Tuple:
+        return tuple(os.stat(path).st_mtime_ns for _, path, _, _ in self.slots)
+
+    def refresh(self):
+        """Перечитать файлы, если они изменились с прошлой загрузки."""
+        stamps = self._file_stamps()
+        if stamps == self._stamps:
+            return
+        try:
+            meals = {slot: _validate(slot, _load_json(path)) for slot, path, _, _ in self.slots}
+        except (OSError, ValueError) as e:
+            if self._stamps is None:
+                raise
+            log.error("Meal catalog reload failed, keeping previous version: %s", e)
+            self._stamps = stamps
+            return
+        meal_totals = {
+            slot: [_normalize_totals(_meal_totals_or_recalc(m)) for m in items]
+            for slot, items in meals.items()
+        }
+        day_totals = {}
+        for day in range(1, DAYS_IN_CYCLE + 1):
+            picked = [_pick_by_day(meal_totals[slot], day) for slot, *_ in self.slots]
+            picked = [t for t in picked if t]
+            day_totals[day] = {m: sum(t[m] or 0.0 for t in picked) for m in MACROS} if picked else None
+        # подмена целиком: обработчики не увидят наполовину загруженный каталог
+        self.meals, self.meal_totals, self.day_totals = meals, meal_totals, day_totals
+        self._rendered = {}
+        self._stamps = stamps
+        self.version += 1
+        log.info("Meal catalog loaded (version %d)", self.version)
+
+    def render_day(self, day_num: int) -> str:
+        """Блоки приёмов пищи и итог дня (без заголовка с датой)."""
+        self.refresh()
+        text = self._rendered.get(day_num)
+        if text is None:
+            blocks = []
+            for slot, _, title, emoji in self.slots:
+                meals = self.meals[slot]
+                idx = (day_num - 1) % len(meals) if meals else None
+                meal = meals[idx] if idx is not None else {}
+                totals = self.meal_totals[slot][idx] if idx is not None else None
+                blocks.append(_format_meal_block(title, emoji, meal, totals))
+            footer = ""
+            total = self.day_totals.get((day_num - 1) % DAYS_IN_CYCLE + 1)
+            if total:
+                footer = (
+                    "\n\n<b>ИТОГО за день:</b>\n"
+                    f" • {_fmt_kcal(total['kcal'])}\n"
+                    f" • Белки: {_fmt_g_macro(total['protein_g'])}\n"
+                    f" • Жиры:  {_fmt_g_macro(total['fat_g'])}\n"
+                    f" • Углев: {_fmt_g_macro(total['carbs_g'])}"
+                )
+            text = "\n\n".join(blocks) + footer
+            self._rendered[day_num] = text
+        return text
+
+
+catalog = MealCatalog()
+
+
 # ---------- core menu builder ----------
 def _build_menu_text(for_date) -> str:
     date_human = for_date.strftime("%d.%m.%Y")
     day_num = for_date.day  # 1..31
 
-    breakfasts = _load_json(BREAKFAST_FILE)
-    lunches = _load_json(LUNCH_FILE)
-    dinners = _load_json(DINNER_FILE)
-    snack1 = _load_json(SNACK1_FILE)
-    snack2 = _load_json(SNACK2_FILE)
-
-    b = _pick_by_day(breakfasts, day_num)
-    s1 = _pick_by_day(snack1, day_num)
-    l = _pick_by_day(lunches, day_num)
-    s2 = _pick_by_day(snack2, day_num)
-    d = _pick_by_day(dinners, day_num)
-
-    b_block, b_tot = _format_meal_block("Завтрак", "☕️", b)
-    s1_block, s1_tot = _format_meal_block("Перекус 1", "🥪", s1)
-    l_block, l_tot = _format_meal_block("Обед", "🍲", l)
-    s2_block, s2_tot = _format_meal_block("Полдник", "🍎", s2)
-    d_block, d_tot = _format_meal_block("Ужин", "🍛", d)
-
-    totals_list = [t for t in (b_tot, s1_tot, l_tot, s2_tot, d_tot) if t]
-    footer = ""
-    if totals_list:
-        kcal = sum(_num(t.get("kcal")) or 0.0 for t in totals_list)
-        prot = sum(_num(t.get("protein_g")) or 0.0 for t in totals_list)
-        fat = sum(_num(t.get("fat_g")) or 0.0 for t in totals_list)
-        carb = sum(_num(t.get("carbs_g")) or 0.0 for t in totals_list)
-        footer = (
-            "\n\n<b>ИТОГО за день:</b>\n"
-            f" • {_fmt_kcal(kcal)}\n"
-            f" • Белки: {_fmt_g_macro(prot)}\n"
-            f" • Жиры:  {_fmt_g_macro(fat)}\n"
-            f" • Углев: {_fmt_g_macro(carb)}"
-        )
-
     header = f"🍽 <b>Меню на {date_human}</b>\n<i>Номер дня по МСК: {day_num}</i>"
-    return f"{header}\n\n{b_block}\n\n{s1_block}\n\n{l_block}\n\n{s2_block}\n\n{d_block}{footer}"
+    return f"{header}\n\n{catalog.render_day(day_num)}"
 
 
 # ---------- handlers ----------
 async def handle_what_to_eat_today(message: Message):
     today = datetime.now(TIMEZONE).date()
-    await message.answer(_build_menu_text(today))
+    with span("menu.build"):
+        text = _build_menu_text(today)
+    await message.answer(text)
 
 
 async def handle_what_to_eat_tomorrow(message: Message):
     tomorrow = (datetime.now(TIMEZONE) + timedelta(days=1)).date()
-    await message.answer(_build_menu_text(tomorrow))
+    with span("menu.build"):
+        text = _build_menu_text(tomorrow)
+    await message.answer(text)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from logging_conf import log_context
+
+log = logging.getLogger("metrics")
+
+# секунды: от быстрых чтений из кэша до построения графика
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Sequence[Tuple[str, Any]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _value(v: float) -> str:
+    # без %g: большие счётчики не должны терять точность
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Metric:
+    """
+    Минимальные метрики в текстовом формате Prometheus — без prometheus_client.
+    Всё обновляется из event loop, поэтому блокировки не нужны.
+    """
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, Any] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> tuple:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, list(zip(self.labelnames, key)), value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{_labels(pairs)} {_value(value)}" for name, pairs, value in self._samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [счётчики по корзинам..., сумма, количество]
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        for key, state in sorted(self._values.items()):
+            pairs = list(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket", pairs + [("le", f"{bound:g}")], count
+            yield f"{self.name}_bucket", pairs + [("le", "+Inf")], state[-1]
+            yield f"{self.name}_sum", pairs, state[-2]
+            yield f"{self.name}_count", pairs, state[-1]
+
+
+def render_all() -> str:
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+
+HANDLER_SECONDS = Histogram("weightbot_handler_seconds", "Handler latency", ["handler"])
+HANDLER_ERRORS = Counter("weightbot_handler_errors_total", "Handlers that raised", ["handler"])
+HANDLER_IN_FLIGHT = Gauge("weightbot_handler_in_flight", "Handlers running right now", ["handler"])
+SPAN_SECONDS = Histogram("weightbot_span_seconds", "Time inside storage, rendering and Telegram calls", ["span"])
+LOOP_LAG = Gauge("weightbot_loop_lag_seconds", "Last measured event loop scheduling delay")
+
+
+def span(name: str):
+    """with span("storage.add_weight"): ... — время участка обработки."""
+    return SPAN_SECONDS.time(span=name)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Латентность, ошибки и число выполняющихся вызовов по каждому хэндлеру.
+    Вешается на уровень хэндлеров (dp.message.middleware(...)), где уже известно,
+    какой хэндлер выбран фильтрами; outer-middleware этого не знает.
+    Заодно кладёт update_id/user_id/handler в контекст логов и пишет строку
+    с латентностью на каждый обработанный апдейт.
+    """
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any,
+                      data: Dict[str, Any]) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        update = data.get("event_update")
+        user = data.get("event_from_user")
+        token = log_context.set({
+            "update_id": getattr(update, "update_id", None),
+            "user_id": getattr(user, "id", None),
+            "handler": name,
+        })
+        HANDLER_IN_FLIGHT.inc(handler=name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, handler=name)
+            HANDLER_IN_FLIGHT.dec(handler=name)
+            log.info("Handled %s in %.1fms", name, elapsed * 1000, extra={"latency_ms": round(elapsed * 1000, 2)})
+            log_context.reset(token)
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Время запросов к Bot API (bot.session.middleware(...)), по методам."""
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{type(method).__name__}"):
+            return await make_request(bot, method)
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(body=render_all().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Разовый перенос data.json (вместе с журналом) в SQLite.
+
+    python migrate_to_sqlite.py [--json data/data.json] [--db data/data.sqlite3]
+
+Без --json переносятся все шарды: data.json и data/groups/<код>.json
+(в data/groups/<код>.sqlite3). Повторный запуск безопасен: уже перенесённые
+записи (user_key, date) пропускаются.
+После переноса выставьте STORAGE_BACKEND=sqlite.
+"""
+import argparse
+import logging
+from pathlib import Path
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from config import DATA_PATH, SQLITE_PATH, GROUPS_DIR
+from logging_conf import setup_logging
+from storage import Storage
+from storage_sqlite import SqliteStorage
+
+log = logging.getLogger("migrate")
+
+
+def migrate(json_path: Path, db_path: Path) -> int:
+    # читаем через Storage, чтобы учесть ещё не свёрнутый журнал
+    data = Storage(json_path)._read()
+
+    # роли группы берём из самого шарда: у групп из /newgroup они свои, не USERS
+    roster = {key: u.get("name") or key for key, u in data["users"].items()}
+    st = SqliteStorage(db_path, roster=roster)
+    conn = st._conn
+    with st._lock, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO meta(key, value) VALUES ('start_date', ?)",
+            (data["start_date"],),
+        )
+        for key, u in data["users"].items():
+            conn.execute(
+                "INSERT INTO users(user_key, name, telegram_id, remind_at, tz) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_key) DO UPDATE SET name = excluded.name, telegram_id = excluded.telegram_id, "
+                "remind_at = excluded.remind_at, tz = excluded.tz",
+                (key, u.get("name") or key, u.get("telegram_id"), u.get("remind_at"), u.get("tz")),
+            )
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO weights(id, user_key, date, weight) VALUES (?, ?, ?, ?)",
+            ((w.get("id"), w["user_key"], w["date"], float(w["weight"])) for w in data["weights"]),
+        )
+        imported = conn.total_changes - before
+        st._bump_revision()
+    st.close()
+
+    skipped = len(data["weights"]) - imported
+    log.info("Migrated %s -> %s: %d weights imported, %d skipped", json_path, db_path, imported, skipped)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос data.json в SQLite")
+    parser.add_argument("--json", type=Path, help="один файл; по умолчанию все шарды")
+    parser.add_argument("--db", type=Path, help="по умолчанию рядом с --json, .sqlite3")
+    args = parser.parse_args()
+    setup_logging()
+    if args.json:
+        migrate(args.json, args.db or args.json.with_suffix(".sqlite3"))
+        return
+    migrate(Path(DATA_PATH), Path(SQLITE_PATH))
+    for json_path in sorted(GROUPS_DIR.glob("*.json")):
+        migrate(json_path, json_path.with_suffix(".sqlite3"))
+
+
+if __name__ == "__main__":
+    main()
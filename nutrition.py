@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import logging
+from typing import List, Optional
+
+import numpy as np
+from aiogram.types import Message
+
+from config import NUTRITION_KCAL_LIMIT
+from meals import catalog, MACROS, DAYS_IN_CYCLE, _num, _fmt_kcal, _fmt_g_macro
+
+log = logging.getLogger("nutrition")
+
+# границы недель внутри 31-дневного цикла (последняя — дни 29–31)
+WEEK_STARTS = np.array([0, 7, 14, 21, 28])
+# ккал на грамм: белки, жиры, углеводы
+KCAL_PER_G = np.array([4.0, 9.0, 4.0])
+
+
+class NutritionPlan:
+    """
+    Меню, собранное в массивы NumPy:
+    items — позиции × КБЖУ, item_meal — номер приёма пищи для каждой позиции,
+    meal_totals — приёмы пищи × КБЖУ, days — дни цикла × КБЖУ.
+    Все сводки считаются векторными свёртками по этим массивам.
+    """
+    def __init__(self, version: int, meals_by_slot: dict, slots: List[str]):
+        self.version = version
+        item_rows, item_meal, given, has_given = [], [], [], []
+        slot_offsets, slot_sizes = [], []
+        meal_no = 0
+        for slot in slots:
+            slot_offsets.append(meal_no)
+            slot_sizes.append(len(meals_by_slot[slot]))
+            for meal in meals_by_slot[slot]:
+                for it in meal.get("items") or []:
+                    item_rows.append([_num(it.get(m)) for m in MACROS])
+                    item_meal.append(meal_no)
+                mt = meal.get("meal_totals")
+                ok = isinstance(mt, dict) and any(mt.values())
+                given.append([_num(mt.get(m)) for m in MACROS] if ok else [None] * len(MACROS))
+                has_given.append(ok)
+                meal_no += 1
+
+        # None → NaN → 0: отсутствующие значения в суммы не попадают
+        self.items = np.nan_to_num(np.array(item_rows, dtype=float).reshape(-1, len(MACROS)))
+        self.item_meal = np.array(item_meal, dtype=np.intp)
+        recalc = np.zeros((meal_no, len(MACROS)))
+        np.add.at(recalc, self.item_meal, self.items)
+        given = np.nan_to_num(np.array(given, dtype=float).reshape(-1, len(MACROS)))
+        # как в _meal_totals_or_recalc: готовые итоги из файла, иначе сумма по позициям
+        self.meal_totals = np.where(np.array(has_given)[:, None], given, recalc)
+
+        # день d берёт из каждого слота приём (d - 1) % len(слота)
+        day_idx = np.arange(DAYS_IN_CYCLE)
+        self.days = np.zeros((DAYS_IN_CYCLE, len(MACROS)))
+        for offset, size in zip(slot_offsets, slot_sizes):
+            if size:
+                self.days += self.meal_totals[offset + day_idx % size]
+
+    def week_totals(self) -> np.ndarray:
+        return np.add.reduceat(self.days, WEEK_STARTS, axis=0)
+
+    def week_lengths(self) -> np.ndarray:
+        return np.diff(np.append(WEEK_STARTS, DAYS_IN_CYCLE))
+
+    def month_totals(self) -> np.ndarray:
+        return self.days.sum(axis=0)
+
+    @staticmethod
+    def macro_ratios(totals: np.ndarray) -> np.ndarray:
+        """Доли энергии из Б/Ж/У (в процентах) для вектора или матрицы КБЖУ."""
+        energy = totals[..., 1:] * KCAL_PER_G
+        s = energy.sum(axis=-1, keepdims=True)
+        return np.divide(energy * 100.0, s, out=np.zeros_like(energy), where=s > 0)
+
+    def days_over(self, kcal: float) -> np.ndarray:
+        """Номера дней цикла (1..31), где калорийность выше kcal."""
+        return np.flatnonzero(self.days[:, 0] > kcal) + 1
+
+
+_plan: Optional[NutritionPlan] = None
+
+
+def get_plan() -> NutritionPlan:
+    """Скомпилированный план; пересобирается, только если каталог перечитан."""
+    global _plan
+    catalog.refresh()
+    if _plan is None or _plan.version != catalog.version:
+        _plan = NutritionPlan(catalog.version, catalog.meals, [slot for slot, *_ in catalog.slots])
+        log.info("Nutrition plan compiled (catalog version %d)", catalog.version)
+    return _plan
+
+
+def _summary_line(title: str, totals: np.ndarray, n_days: int, ratios: np.ndarray) -> str:
+    kcal, prot, fat, carb = totals
+    return (
+        f"<b>{title}</b>: {_fmt_kcal(kcal)}, в среднем {_fmt_kcal(kcal / n_days)}/день\n"
+        f" Б {_fmt_g_macro(prot)}, Ж {_fmt_g_macro(fat)}, У {_fmt_g_macro(carb)} "
+        f"({ratios[0]:.0f}/{ratios[1]:.0f}/{ratios[2]:.0f} % ккал)"
+    )
+
+
+def build_nutrition_text(kcal_limit: float = NUTRITION_KCAL_LIMIT) -> str:
+    plan = get_plan()
+    weeks, lengths = plan.week_totals(), plan.week_lengths()
+    week_ratios = plan.macro_ratios(weeks)
+    lines = ["📊 <b>Питание по 31-дневному циклу</b>"]
+    for i, (totals, n, ratios) in enumerate(zip(weeks, lengths, week_ratios)):
+        first = int(WEEK_STARTS[i]) + 1
+        lines.append(_summary_line(f"Неделя {i + 1} (дни {first}–{first + int(n) - 1})", totals, int(n), ratios))
+    month = plan.month_totals()
+    lines.append(_summary_line("Весь цикл", month, DAYS_IN_CYCLE, plan.macro_ratios(month)))
+    over = plan.days_over(kcal_limit)
+    over_txt = ", ".join(str(d) for d in over) if over.size else "нет"
+    lines.append(f"Дней больше {_fmt_kcal(kcal_limit)}: {over.size} ({over_txt})")
+    return "\n\n".join(lines)
+
+
+# ---------- handlers ----------
+async def handle_nutrition(message: Message):
+    """/nutrition [ккал] — недельные и месячная сводки по меню."""
+    parts = (message.text or "").split(maxsplit=1)
+    kcal_limit = NUTRITION_KCAL_LIMIT
+    if len(parts) == 2:
+        limit = _num(parts[1].replace(",", ".").strip())
+        if limit is None or limit <= 0:
+            await message.answer("Использование: /nutrition 2300")
+            return
+        kcal_limit = limit
+    await message.answer(build_nutrition_text(kcal_limit))
@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta, time as dtime
+from typing import Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
 from aiogram import Bot
-from config import TIMEZONE
-from storage import Storage
+from config import TIMEZONE, DEFAULT_REMINDER_TIME
+from groups import GroupRegistry
+from broadcast import Broadcaster
 import logging
 log = logging.getLogger("scheduler")
 
@@ -12,33 +19,182 @@ REMINDER_TEXT = (
     "Пора отправить вес натощак. Нажмите «Внести вес» и введите число (например, 82.4)."
 )
 
-def setup_scheduler(bot: Bot, storage: Storage) -> AsyncIOScheduler:
+
+def parse_hhmm(value: str) -> dtime:
+    """"07:30" → time(7, 30); ValueError при неверном формате."""
+    hh, mm = value.strip().split(":")
+    return dtime(int(hh), int(mm))
+
+
+def next_due(remind_at: dtime, tz: ZoneInfo, now: Optional[datetime] = None) -> float:
+    """Ближайший момент remind_at по местному времени tz (unix timestamp)."""
+    now = (now or datetime.now(tz)).astimezone(tz)
+    due = datetime.combine(now.date(), remind_at, tzinfo=tz)
+    if due <= now:
+        due = datetime.combine(now.date() + timedelta(days=1), remind_at, tzinfo=tz)
+    return due.timestamp()
+
+
+class ReminderScheduler:
     """
-    Создаёт и запускает планировщик.
-    В 08:00 Europe/Amsterdam шлём напоминание обоим зарегистрированным.
+    Личные напоминания всех пользователей всех групп в одной min-куче
+    (момент, seq, telegram_id).
+    Цикл спит ровно до ближайшего момента (или до изменения расписания), никакого
+    опроса и отдельной задачи на пользователя. Перестановка — O(log n): старая
+    запись в куче просто становится неактуальной и отбрасывается при извлечении.
+    Рассылка волны идёт отдельной задачей: цикл сразу возвращается к куче.
+    Настройки пользователей читаются из шардов в фоне уже после старта бота,
+    так что время старта не зависит от числа групп.
     """
-    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+    def __init__(self, bot: Bot, groups: GroupRegistry, broadcaster: Optional[Broadcaster] = None):
+        self.groups = groups
+        self.broadcaster = broadcaster or Broadcaster(bot)
+        self._heap: List[Tuple[float, int, int]] = []
+        self._seq = itertools.count()
+        self._active: Dict[int, Tuple[float, int]] = {}      # telegram_id → (момент, seq) актуальной записи
+        self._owner: Dict[int, Tuple[str, str]] = {}         # telegram_id → (group_id, user_key)
+        self._plan: Dict[int, Tuple[dtime, ZoneInfo]] = {}
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._waves: Set[asyncio.Task] = set()
+        self._loader: Optional[asyncio.Task] = None
+        self._touched: Optional[Set[int]] = None   # кого переставили, пока идёт загрузка
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run(), name="reminders")
+        self._touched = set()
+        self._loader = asyncio.create_task(self._load(), name="reminders-load")
+        log.info("Reminder scheduler started")
+
+    async def _load(self):
+        group_ids = {group_id for _, group_id in self.groups.iter_members()}
+        for group_id in group_ids:
+            try:
+                users = await self.groups.registered_users(group_id)
+            except Exception:
+                log.exception("Failed to load reminders of group %s", group_id)
+                continue
+            for user_key, info in users.items():
+                tg_id = info["telegram_id"]
+                if tg_id not in self._touched:   # /remind или регистрация во время загрузки новее
+                    self._schedule(tg_id, group_id, user_key, info.get("remind_at"), info.get("tz"))
+        self._touched = None
+        log.info("Reminders loaded: %d users in %d groups", len(self._active), len(group_ids))
+
+    async def stop(self):
+        for task in (self._loader, self._task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._loader = self._task = None
+        for wave in list(self._waves):
+            wave.cancel()
+        await asyncio.gather(*self._waves, return_exceptions=True)
+
+    def schedule(self, tg_id: int, group_id: str, user_key: str,
+                 remind_at: Optional[str] = None, tz: Optional[str] = None):
+        """Поставить (или переставить) напоминание пользователя."""
+        if self._touched is not None:
+            self._touched.add(tg_id)
+        self._schedule(tg_id, group_id, user_key, remind_at, tz)
 
-    import logging
-    log = logging.getLogger("scheduler")
+    def _schedule(self, tg_id: int, group_id: str, user_key: str,
+                  remind_at: Optional[str], tz: Optional[str]):
+        if remind_at == "off":
+            self.unschedule(tg_id)
+            return
+        at = parse_hhmm(remind_at or DEFAULT_REMINDER_TIME)
+        zone = ZoneInfo(tz) if tz else TIMEZONE
+        self._owner[tg_id] = (group_id, user_key)
+        self._plan[tg_id] = (at, zone)
+        self._push(tg_id, next_due(at, zone))
 
-    # ...
-    async def morning_broadcast():
-        users = storage.get_registered_users()
-        for _, info in users.items():
-            tg_id = info.get("telegram_id")
-            if tg_id:
+    def unschedule(self, tg_id: int):
+        if self._touched is not None:
+            self._touched.add(tg_id)
+        self._active.pop(tg_id, None)
+        self._plan.pop(tg_id, None)
+        self._owner.pop(tg_id, None)
+
+    def _push(self, tg_id: int, due: float):
+        seq = next(self._seq)
+        self._active[tg_id] = (due, seq)
+        heapq.heappush(self._heap, (due, seq, tg_id))
+        if self._heap[0][1] == seq:
+            self._changed.set()   # новая ближайшая точка — разбудить цикл
+
+    def _pop_due(self, now: float) -> List[int]:
+        due_users = []
+        while self._heap and self._heap[0][0] <= now:
+            due, seq, tg_id = heapq.heappop(self._heap)
+            if self._active.get(tg_id) == (due, seq):
+                due_users.append(tg_id)
+        return due_users
+
+    def _drop_stale_top(self):
+        while self._heap and self._active.get(self._heap[0][2]) != self._heap[0][:2]:
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._drop_stale_top()
+            self._changed.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
                 try:
-                    await bot.send_message(chat_id=tg_id, text=REMINDER_TEXT)
-                    log.info("Reminder sent to %s", tg_id)
-                except Exception as e:
-                    log.exception("Reminder failed to %s: %s", tg_id, e)
-
-    scheduler.add_job(
-        morning_broadcast,
-        trigger=CronTrigger(hour=8, minute=0, timezone=TIMEZONE),
-        id="daily_reminder",
-        replace_existing=True,
-    )
-    scheduler.start()
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                    continue   # расписание изменилось — пересчитать ожидание
+                except asyncio.TimeoutError:
+                    pass
+            due_users = self._pop_due(time.time())
+            if due_users:
+                self._fire(due_users)
+
+    def _fire(self, tg_ids: List[int]):
+        targets = []
+        for tg_id in tg_ids:
+            if tg_id not in self._plan:
+                continue
+            at, zone = self._plan[tg_id]
+            # следующая точка — сразу, чтобы не зависеть от исхода отправки
+            self._push(tg_id, next_due(at, zone))
+            targets.append((tg_id, *self._owner[tg_id]))
+        wave = asyncio.create_task(self._wave(targets), name="reminder-wave")
+        self._waves.add(wave)
+        wave.add_done_callback(self._wave_done)
+
+    def _wave_done(self, wave: asyncio.Task):
+        self._waves.discard(wave)
+        if not wave.cancelled() and wave.exception() is not None:
+            log.error("Reminder wave failed", exc_info=wave.exception())
+
+    async def _wave(self, targets: List[Tuple[int, str, str]]):
+        # даты записей веса хранятся по TIMEZONE — по нему и проверяем «сегодня»
+        today = datetime.now(TIMEZONE).date().isoformat()
+        chat_ids, skipped = [], 0
+        for tg_id, group_id, user_key in targets:
+            if tg_id not in self._plan:
+                continue   # напоминание отключили, пока шла волна
+            st = await self.groups.shard(group_id)
+            if await st.get_day_entry(user_key, today):
+                skipped += 1
+                continue
+            chat_ids.append(tg_id)
+        log.info("Reminder wave: %d due, %d already weighed in", len(targets), skipped)
+        if chat_ids:
+            stats = await self.broadcaster.broadcast(chat_ids, REMINDER_TEXT)
+            log.info("Reminders: %s", stats)
+
+
+async def setup_scheduler(bot: Bot, groups: GroupRegistry) -> ReminderScheduler:
+    """
+    Создаёт и запускает планировщик напоминаний.
+    По умолчанию — в DEFAULT_REMINDER_TIME по TIMEZONE, свои время и пояс задаются через /remind.
+    Тем, кто уже записал вес сегодня, напоминание не шлём.
+    """
+    scheduler = ReminderScheduler(bot, groups)
+    await scheduler.start()
     return scheduler
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+log = logging.getLogger("startup")
+
+# отсчёт от импорта этого модуля — bot.py импортирует его первым
+_T0 = time.perf_counter()
+# канал готовности к supervisor.py (дескриптор пайпа, см. notify_supervisor)
+READY_FD_ENV = "WEIGHTBOT_READY_FD"
+
+
+def notify_supervisor(state: str):
+    """Строка state в пайп готовности: "ready" — импорт закончен, "up" — бот работает."""
+    fd = os.getenv(READY_FD_ENV)
+    if not fd:
+        return
+    try:
+        os.write(int(fd), f"{state}\n".encode())
+    except OSError as e:
+        log.warning("Cannot notify supervisor: %s", e)
+
+
+def wait_for_promotion() -> bool:
+    """
+    Резервный режим (bot.py --standby): всё тяжёлое уже импортировано,
+    ждём от supervisor.py строку "go" в stdin. False — supervisor ушёл, запускаться не надо.
+    """
+    notify_supervisor("ready")
+    return sys.stdin.readline().strip() == "go"
+
+
+class StartupReport:
+    """
+    Замеры холодного старта: стоимость групп импортов и шагов запуска,
+    время до готовности (старт polling) и до первого обработанного апдейта.
+    Итог пишется в лог и в path (JSON), чтобы время перезапуска можно было сравнивать.
+    """
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else None
+        self.steps: List[Tuple[str, float]] = []
+        self.ready_at: Optional[float] = None
+        self.first_update_at: Optional[float] = None
+        self.t0 = _T0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def restart_clock(self):
+        """Резервный процесс повышен: готовность считаем от этого момента, импорты уже оплачены."""
+        self.steps.append(("standby wait", time.perf_counter() - self.t0))
+        self.t0 = time.perf_counter()
+
+    @contextmanager
+    def step(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started))
+
+    def mark_ready(self):
+        self.ready_at = self.elapsed()
+        log.info("Bot ready in %.3fs", self.ready_at)
+        notify_supervisor("up")
+
+    def as_dict(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "steps": {name: round(sec, 4) for name, sec in self.steps},
+            "ready": None if self.ready_at is None else round(self.ready_at, 4),
+            "first_update": None if self.first_update_at is None else round(self.first_update_at, 4),
+        }
+
+    def dump(self):
+        slowest = sorted(self.steps, key=lambda s: s[1], reverse=True)
+        log.info("Startup report: ready=%.3fs first_update=%.3fs; %s",
+                 self.ready_at or 0.0, self.first_update_at or 0.0,
+                 ", ".join(f"{name}={sec * 1000:.0f}ms" for name, sec in slowest))
+        if self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.path.write_text(json.dumps(self.as_dict(), indent=2), encoding="utf-8")
+            except OSError as e:
+                log.warning("Cannot write startup report: %s", e)
+
+    async def first_update_middleware(self, handler, event, data):
+        """Outer-middleware на dp.update: фиксирует первый апдейт после старта."""
+        if self.first_update_at is not None:
+            return await handler(event, data)
+        try:
+            return await handler(event, data)
+        finally:
+            if self.first_update_at is None:
+                self.first_update_at = self.elapsed()
+                self.dump()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import bisect
+import html
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+# сглаживание тренда: EMA по записям, span = 7 (α = 2 / (span + 1))
+EMA_ALPHA = 2 / (7 + 1)
+
+
+def ema_series(weights: Iterable[float], alpha: float = EMA_ALPHA) -> List[float]:
+    """Экспоненциально сглаженный ряд (первое значение — сама первая точка)."""
+    out: List[float] = []
+    for w in weights:
+        out.append(w if not out else alpha * w + (1 - alpha) * out[-1])
+    return out
+
+
+class UserStats:
+    """
+    Агрегаты ряда одного пользователя, обновляемые по одной записи.
+    Точки лежат отсортированными по дню (bisect). Для МНК-наклона держим
+    суммы n, Σx, Σy, Σxy, Σx² (x — дни от base) — добавление и правка O(1).
+    Скользящие средние — O(окна) по хвосту ряда. EMA хранится поточечно и
+    пересчитывается только от изменённой точки: правка последних записей
+    стоит O(k), дописывание — O(1).
+    """
+    def __init__(self):
+        self.base: Optional[int] = None   # ordinal первого дня, от него считаются x
+        self.days: List[int] = []
+        self.weights: List[float] = []
+        self._ema: List[float] = []
+        self._n = 0
+        self._sx = self._sy = self._sxy = self._sxx = 0.0
+
+    def _x(self, day: int) -> float:
+        return float(day - self.base)
+
+    def _account(self, day: int, w: float, sign: int):
+        x = self._x(day)
+        self._n += sign
+        self._sx += sign * x
+        self._sy += sign * w
+        self._sxy += sign * x * w
+        self._sxx += sign * x * x
+
+    def _refresh_ema(self, start: int):
+        del self._ema[start:]
+        prev = self._ema[-1] if self._ema else None
+        for w in self.weights[start:]:
+            prev = w if prev is None else EMA_ALPHA * w + (1 - EMA_ALPHA) * prev
+            self._ema.append(prev)
+
+    def add(self, day_iso: str, weight: float):
+        day = date.fromisoformat(day_iso).toordinal()
+        if self.base is None:
+            self.base = day
+        i = bisect.bisect_left(self.days, day)
+        if i < len(self.days) and self.days[i] == day:
+            self.update(day_iso, weight)
+            return
+        self.days.insert(i, day)
+        self.weights.insert(i, float(weight))
+        self._account(day, float(weight), +1)
+        self._refresh_ema(i)
+
+    def update(self, day_iso: str, weight: float):
+        day = date.fromisoformat(day_iso).toordinal()
+        i = bisect.bisect_left(self.days, day)
+        if i == len(self.days) or self.days[i] != day:
+            self.add(day_iso, weight)
+            return
+        self._account(day, self.weights[i], -1)
+        self.weights[i] = float(weight)
+        self._account(day, self.weights[i], +1)
+        self._refresh_ema(i)
+
+    # --- Показатели ---
+    def moving_average(self, window_days: int) -> Optional[float]:
+        """Среднее за последние window_days календарных дней (от последней записи)."""
+        if not self.days:
+            return None
+        lo = bisect.bisect_left(self.days, self.days[-1] - window_days + 1)
+        tail = self.weights[lo:]
+        return sum(tail) / len(tail)
+
+    @property
+    def ema(self) -> Optional[float]:
+        return self._ema[-1] if self._ema else None
+
+    def slope(self) -> Optional[float]:
+        """Наклон линии МНК, кг в день; None, если точек меньше двух."""
+        denom = self._n * self._sxx - self._sx * self._sx
+        if self._n < 2 or denom <= 0:
+            return None
+        return (self._n * self._sxy - self._sx * self._sy) / denom
+
+    def projected_date(self, target: float) -> Optional[date]:
+        """Когда линия тренда дойдёт до target; None, если тренд туда не ведёт."""
+        k = self.slope()
+        if k is None or not self.weights:
+            return None
+        if min(self.weights[-1], self.ema) <= target:
+            return date.fromordinal(self.days[-1])   # уже дошли
+        if k >= 0:
+            return None
+        b = (self._sy - k * self._sx) / self._n
+        x = (target - b) / k
+        last_x = self._x(self.days[-1])
+        return date.fromordinal(self.base) + timedelta(days=max(x, last_x))
+
+    def summary(self, target: Optional[float] = None) -> dict:
+        k = self.slope()
+        projected = None if target is None else self.projected_date(target)
+        return {
+            "count": len(self.days),
+            "last_date": date.fromordinal(self.days[-1]).isoformat() if self.days else None,
+            "last": self.weights[-1] if self.weights else None,
+            "ma7": self.moving_average(7),
+            "ma30": self.moving_average(30),
+            "ema": self.ema,
+            "slope_per_week": None if k is None else k * 7,
+            "target": target,
+            "projected": projected.isoformat() if projected else None,
+        }
+
+
+def _kg(v: Optional[float]) -> str:
+    return "—" if v is None else f"{v:.1f} кг"
+
+
+def format_stats(name: str, s: dict) -> str:
+    """Текст для /stats по словарю UserStats.summary()."""
+    if not s["count"]:
+        return "Пока нет ни одной записи веса."
+    lines = [
+        f"📊 <b>{html.escape(name)}</b>: {s['count']} записей, последняя {_kg(s['last'])} ({s['last_date']})",
+        f"Среднее за 7 дней: {_kg(s['ma7'])}",
+        f"Среднее за 30 дней: {_kg(s['ma30'])}",
+        f"Сглаженный тренд: {_kg(s['ema'])}",
+    ]
+    if s["slope_per_week"] is not None:
+        lines.append(f"Темп: {s['slope_per_week']:+.2f} кг/неделю")
+    if s["target"] is not None:
+        if s["projected"]:
+            when = date.fromisoformat(s["projected"]).strftime("%d.%m.%Y")
+            lines.append(f"Цель {_kg(s['target'])}: ориентировочно {when}")
+        else:
+            lines.append(f"Цель {_kg(s['target'])}: при текущем темпе не достигается")
+    return "\n".join(lines)
+
+
+class StatsIndex:
+    """
+    UserStats по пользователям хранилища. Строится лениво — при первом запросе
+    пользователя из его ряда, дальше хранилище лишь сообщает об изменениях
+    (note_add/note_update); пользователи, которых ещё не спрашивали, ничего не стоят.
+    """
+    def __init__(self):
+        self._users: Dict[str, UserStats] = {}
+
+    def clear(self):
+        self._users.clear()
+
+    def get(self, user_key: str, series_loader) -> UserStats:
+        st = self._users.get(user_key)
+        if st is None:
+            st = UserStats()
+            for rec in series_loader(user_key):
+                st.add(rec["date"], rec["weight"])
+            self._users[user_key] = st
+        return st
+
+    def note_add(self, user_key: str, day_iso: str, weight: float):
+        st = self._users.get(user_key)
+        if st is not None:
+            st.add(day_iso, weight)
+
+    def note_update(self, user_key: str, day_iso: str, weight: float):
+        st = self._users.get(user_key)
+        if st is not None:
+            st.update(day_iso, weight)
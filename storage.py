@@ -1,129 +1,416 @@
 # -*- coding: utf-8 -*-
+import bisect
 import json
 import logging
+import os
+import threading
+import time
 from pathlib import Path
 from datetime import date
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from config import DATA_PATH, USERS
+from stats import StatsIndex
+from config import DATA_PATH, SQLITE_PATH, GROUPS_DIR, DEFAULT_GROUP, USERS, STORAGE_BACKEND
 
 log = logging.getLogger("storage")
 
+Stamp = Optional[Tuple[int, int, int]]
+
+
+def _file_stamp(path: Path) -> Stamp:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _write_tmp(path: Path, text: str) -> Path:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+
+def _atomic_write_text(path: Path, text: str):
+    """Запись через временный файл + os.replace: на диске всегда либо старая, либо новая версия."""
+    os.replace(_write_tmp(path, text), path)
+
+
 class Storage:
     """
     JSON-хранилище.
+    Данные держим в памяти: файл парсится один раз и перечитывается,
+    только если его изменили снаружи (сменились inode/размер/mtime).
+
+    Изменения не переписывают data.json, а дописываются строкой в журнал
+    data.journal.jsonl; при загрузке журнал проигрывается поверх снимка.
+    Каждые COMPACT_EVERY записей журнал в фоне сворачивается в новый снимок
+    (временный файл + os.replace). Записи журнала нумеруются (seq), снимок
+    помнит последний учтённый seq — поэтому падение посреди сворачивания
+    ничего не теряет и не дублирует.
+
+    У каждой записи веса есть постоянный id. В памяти поддерживаются индексы:
+    id → запись, (user_key, date) → id и отсортированный по дате ряд
+    каждого пользователя (bisect), так что выборки не сканируют весь список.
     """
-    def __init__(self, path: Path = Path(DATA_PATH)):
+    COMPACT_EVERY = 200
+
+    def __init__(self, path: Path = Path(DATA_PATH), roster: Dict[str, str] = USERS):
         self.path = Path(path)
+        self.roster = dict(roster)  # роли группы: user_key → имя
+        self.journal_path = self.path.with_name(self.path.stem + ".journal.jsonl")
         self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._data: Optional[dict] = None
+        self._stamp: Tuple[Stamp, Stamp] = (None, None)
+        self._pending = 0  # записей в журнале сверх снимка
+        self._compacting = False  # фоновое сворачивание уже запущено
+        self._torn_at: Optional[int] = None  # длина журнала без недописанной последней строки
+        self._by_id: Dict[int, dict] = {}
+        self._by_day: Dict[Tuple[str, str], int] = {}
+        self._series: Dict[str, List[Tuple[str, int]]] = {}
+        self._stats = StatsIndex()
+        self._by_tg: Dict[int, str] = {}   # telegram_id → user_key
+        self._next_id = 1
         if not self.path.exists():
             self._init_file()
 
     def _init_file(self):
         data = {
-            "users": {k: {"telegram_id": None, "name": v} for k, v in USERS.items()},
+            "users": {k: {"telegram_id": None, "name": v} for k, v in self.roster.items()},
             "weights": [],
             "start_date": date.today().isoformat(),
+            "seq": 0,
         }
-        self._write(data)
+        _atomic_write_text(self.path, json.dumps(data, ensure_ascii=False, indent=2))
+
+    def _stamps(self) -> Tuple[Stamp, Stamp]:
+        return _file_stamp(self.path), _file_stamp(self.journal_path)
 
     def _read(self) -> dict:
+        with self._lock:
+            if self._data is None or self._stamps() != self._stamp:
+                self._load()
+                self._stamp = self._stamps()
+            return self._data
+
+    def _load(self):
         with self.path.open("r", encoding="utf-8") as f:
-            return json.load(f)
+            data = json.load(f)
+        data.setdefault("seq", 0)
+        self._reindex(data)
+        replayed = 0
+        self._torn_at = None
+        if self.journal_path.exists():
+            text = self.journal_path.read_text(encoding="utf-8")
+            lines = text.splitlines(keepends=True)
+            if lines and not lines[-1].endswith("\n"):
+                # недописанная строка: падение посреди записи или её прямо сейчас дописывает
+                # бот, а читаем мы из другого процесса (export, migrate). Здесь только пропускаем,
+                # обрезает файл сам пишущий — в _commit, перед своей записью
+                lines.pop()
+                self._torn_at = len("".join(lines).encode("utf-8"))
+            for line in lines:
+                entry = json.loads(line)
+                if entry["seq"] > data["seq"]:
+                    self._apply(data, entry)
+                    replayed += 1
+        self._data = data
+        self._pending = replayed
+        log.info("Loaded %s (%d weights, %d journal entries)", self.path, len(data["weights"]), replayed)
+
+    def _reindex(self, data: dict):
+        self._by_id, self._by_day, self._series = {}, {}, {}
+        self._stats.clear()
+        self._by_tg = {u["telegram_id"]: k for k, u in data["users"].items() if u.get("telegram_id")}
+        self._next_id = max((w["id"] for w in data["weights"] if "id" in w), default=0) + 1
+        for w in data["weights"]:
+            if "id" not in w:
+                # записи из старых файлов без id
+                w["id"] = self._next_id
+                self._next_id += 1
+            self._index_add(w)
+
+    def _index_add(self, rec: dict):
+        self._by_id[rec["id"]] = rec
+        self._by_day[(rec["user_key"], rec["date"])] = rec["id"]
+        bisect.insort(self._series.setdefault(rec["user_key"], []), (rec["date"], rec["id"]))
+        self._stats.note_add(rec["user_key"], rec["date"], rec["weight"])
+        self._next_id = max(self._next_id, rec["id"] + 1)
+
+    def _apply(self, data: dict, entry: dict):
+        op = entry["op"]
+        if op == "add":
+            rec = {"id": entry["id"], "user_key": entry["user_key"], "date": entry["date"], "weight": entry["weight"]}
+            data["weights"].append(rec)
+            self._index_add(rec)
+        elif op == "update":
+            if "id" in entry:
+                rec = self._by_id[entry["id"]]
+            else:
+                # журнал до появления id
+                rec = data["weights"][entry["index"]]
+            rec["weight"] = entry["weight"]
+            self._stats.note_update(rec["user_key"], rec["date"], rec["weight"])
+        elif op == "register":
+            old = data["users"].get(entry["user_key"], {}).get("telegram_id")
+            self._by_tg.pop(old, None)
+            # remind_at/tz не трогаем: повторная регистрация не сбрасывает напоминание
+            data["users"].setdefault(entry["user_key"], {}).update(telegram_id=entry["telegram_id"], name=entry["name"])
+            self._by_tg[entry["telegram_id"]] = entry["user_key"]
+        elif op == "reminder":
+            data["users"][entry["user_key"]].update(remind_at=entry["remind_at"], tz=entry["tz"])
+        else:
+            raise ValueError(f"Unknown journal op: {op}")
+        data["seq"] = entry["seq"]
+
+    def _commit(self, entry: dict):
+        """Дописать изменение в журнал и применить его к данным в памяти."""
+        with self._lock:
+            data = self._read()
+            # ts — для восстановления на момент времени (backup.py)
+            entry = {"seq": data["seq"] + 1, "ts": round(time.time(), 3), **entry}
+            try:
+                with self.journal_path.open("a", encoding="utf-8") as f:
+                    if self._torn_at is not None:
+                        # иначе запись склеится с обрывком
+                        log.warning("Dropping torn journal tail in %s", self.journal_path)
+                        f.truncate(self._torn_at)
+                        self._torn_at = None
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception:
+                # память могла разойтись с диском — перечитаем при следующем обращении
+                self.invalidate()
+                raise
+            self._apply(data, entry)
+            self._stamp = self._stamps()
+            self._pending += 1
+            need_compact = self._pending >= self.COMPACT_EVERY and not self._compacting
+            if need_compact:
+                self._compacting = True
+        if need_compact:
+            threading.Thread(target=self._compact_quietly, name="storage-compact", daemon=True).start()
+
+    def compact(self):
+        """Свернуть журнал в новый снимок data.json."""
+        with self._compact_lock:
+            with self._lock:
+                data = self._read()
+                snap_seq = data["seq"]
+                text = json.dumps(data, ensure_ascii=False, indent=2)
+            # тяжёлая запись — без блокировки, писатели продолжают дописывать журнал
+            tmp = _write_tmp(self.path, text)
+            with self._lock:
+                os.replace(tmp, self.path)
+                tail = []
+                if self.journal_path.exists():
+                    with self.journal_path.open("r", encoding="utf-8") as f:
+                        for line in f:
+                            try:
+                                if json.loads(line)["seq"] > snap_seq:
+                                    tail.append(line)
+                            except ValueError:
+                                continue
+                _atomic_write_text(self.journal_path, "".join(tail))
+                self._torn_at = None
+                self._pending = len(tail)
+                self._stamp = self._stamps()
+            log.info("Compacted %s at seq=%d (%d entries left in journal)", self.path, snap_seq, len(tail))
+
+    def _compact_quietly(self):
+        try:
+            self.compact()
+        except Exception:
+            log.exception("Journal compaction failed")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def get_revision(self) -> Tuple[int, Stamp]:
+        """
+        Версия данных: меняется при любой записи или внешней правке файла.
+        Строится из сохранённого seq и отметки снимка, поэтому переживает
+        переоткрытие шарда (кэш графиков не отдаст старую картинку).
+        """
+        with self._lock:
+            data = self._read()
+            return data["seq"], self._stamp[0]
 
-    def _write(self, data: dict):
-        with self.path.open("w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def invalidate(self):
+        """Сбросить кэш: следующий вызов перечитает снимок и журнал с диска."""
+        with self._lock:
+            self._data = None
+            self._stamp = (None, None)
 
     # --- Пользователи ---
     def is_registered(self, tg_id: int) -> bool:
-        data = self._read()
-        return any(u.get("telegram_id") == tg_id for u in data["users"].values())
+        return self.get_user_key_by_tg(tg_id) is not None
 
     def get_user_key_by_tg(self, tg_id: int) -> Optional[str]:
-        data = self._read()
-        for key, u in data["users"].items():
-            if u.get("telegram_id") == tg_id:
-                return key
-        return None
+        with self._lock:
+            self._read()
+            return self._by_tg.get(tg_id)
 
     def register(self, user_key: str, tg_id: int) -> Tuple[bool, str]:
-        if user_key not in USERS:
+        if user_key not in self.roster:
             return False, "Неизвестная роль."
-        data = self._read()
-        current_id = data["users"][user_key].get("telegram_id")
-        if current_id and current_id != tg_id:
-            return False, f"Роль «{USERS[user_key]}» уже занята."
-        existing_key = self.get_user_key_by_tg(tg_id)
-        if existing_key and existing_key != user_key:
-            return False, f"Вы уже зарегистрированы как «{USERS[existing_key]}»."
-        data["users"][user_key]["telegram_id"] = tg_id
-        data["users"][user_key]["name"] = USERS[user_key]
-        self._write(data)
+        with self._lock:
+            data = self._read()
+            current_id = data["users"][user_key].get("telegram_id")
+            if current_id and current_id != tg_id:
+                return False, f"Роль «{self.roster[user_key]}» уже занята."
+            existing_key = self.get_user_key_by_tg(tg_id)
+            if existing_key and existing_key != user_key:
+                return False, f"Вы уже зарегистрированы как «{self.roster[existing_key]}»."
+            self._commit({"op": "register", "user_key": user_key, "telegram_id": tg_id, "name": self.roster[user_key]})
         log.info("Registered user %s as %s (tg_id=%s)", tg_id, user_key, tg_id)
-        return True, f"Успех! Вы зарегистрированы как «{USERS[user_key]}»."
+        return True, f"Успех! Вы зарегистрированы как «{self.roster[user_key]}»."
 
     def get_registered_users(self) -> Dict[str, Dict]:
         data = self._read()
         return {k: v for k, v in data["users"].items() if v.get("telegram_id")}
 
+    def set_reminder(self, user_key: str, remind_at: Optional[str], tz: Optional[str]) -> None:
+        """Время напоминания "ЧЧ:ММ" (или "off") и часовой пояс IANA; None — по умолчанию."""
+        self._commit({"op": "reminder", "user_key": user_key, "remind_at": remind_at, "tz": tz})
+        log.info("Reminder for %s set to %s %s", user_key, remind_at, tz)
+
     # --- Вес ---
     def add_weight(self, user_key: str, weight: float, on_date: Optional[str] = None) -> Tuple[bool, str]:
         """
         Добавляет запись веса. Блокирует повторную запись в тот же день.
         Возвращает (успех, сообщение).
         """
-        data = self._read()
         on_date = on_date or date.today().isoformat()
+        with self._lock:
+            self._read()
 
-        # Запрет: только 1 запись в день
-        if any(w["user_key"] == user_key and w["date"] == on_date for w in data["weights"]):
-            return False, "На сегодня запись уже есть. Разрешена только одна запись в день."
+            # Запрет: только 1 запись в день
+            if (user_key, on_date) in self._by_day:
+                return False, "На сегодня запись уже есть. Разрешена только одна запись в день."
 
-        data["weights"].append({
-            "user_key": user_key,
-            "date": on_date,
-            "weight": float(weight),
-        })
-        self._write(data)
+            self._commit({"op": "add", "id": self._next_id, "user_key": user_key,
+                          "date": on_date, "weight": float(weight)})
         log.info("Added weight: %s %s => %.3f", user_key, on_date, weight)
         return True, "Записал! ✅"
 
     def get_all_weights(self) -> List[dict]:
-        data = self._read()
-        return data["weights"]
+        with self._lock:
+            # копия списка: его читают из других потоков/процессов, пока сюда дописывают
+            return list(self._read()["weights"])
 
     def get_start_date(self) -> str:
         data = self._read()
         return data["start_date"]
 
     def get_user_series(self, user_key: str) -> List[dict]:
-        return [w for w in self.get_all_weights() if w["user_key"] == user_key]
+        """Все записи пользователя по возрастанию даты."""
+        with self._lock:
+            self._read()
+            return [self._by_id[i] for _, i in self._series.get(user_key, [])]
+
+    def get_user_range(self, user_key: str, since: Optional[str] = None,
+                       until: Optional[str] = None) -> List[dict]:
+        """Записи пользователя с датой в [since, until] (ISO, границы включительно)."""
+        with self._lock:
+            self._read()
+            series = self._series.get(user_key, [])
+            lo = bisect.bisect_left(series, (since, 0)) if since else 0
+            hi = bisect.bisect_right(series, (until, float("inf"))) if until else len(series)
+            return [self._by_id[i] for _, i in series[lo:hi]]
+
+    def get_record(self, record_id: int) -> Optional[dict]:
+        with self._lock:
+            self._read()
+            return self._by_id.get(record_id)
+
+    def iter_weights(self, user_key: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None, chunk: int = 1000) -> Iterator[dict]:
+        """
+        Записи (копии) пачками по chunk — блокировка берётся на пачку, а не на весь обход.
+        С user_key — по возрастанию даты, без него — в порядке добавления.
+        """
+        pos = 0
+        while True:
+            with self._lock:
+                data = self._read()
+                if user_key is not None:
+                    series = self._series.get(user_key, [])
+                    lo = bisect.bisect_left(series, (since, 0)) if since else 0
+                    hi = bisect.bisect_right(series, (until, float("inf"))) if until else len(series)
+                    batch = [dict(self._by_id[i]) for _, i in series[lo + pos:min(lo + pos + chunk, hi)]]
+                    done = lo + pos + chunk >= hi
+                else:
+                    # список только дополняется, так что позиция между пачками не «уезжает»
+                    batch = [
+                        dict(w) for w in data["weights"][pos:pos + chunk]
+                        if (not since or w["date"] >= since) and (not until or w["date"] <= until)
+                    ]
+                    done = pos + chunk >= len(data["weights"])
+            yield from batch
+            if done:
+                return
+            pos += chunk
 
     # --- Редактирование последних записей ---
     def get_user_last_entries(self, user_key: str, n: int = 4) -> List[Tuple[int, dict]]:
         """
-        Возвращает последние n записей пользователя как список (индекс_в_массиве, запись),
-        где индекс — позиция в общем списке weights (для последующего обновления).
+        Возвращает последние n записей пользователя (новые первыми)
+        как список (id_записи, запись).
         """
-        data = self._read()
-        enumerated = [(i, w) for i, w in enumerate(data["weights"]) if w["user_key"] == user_key]
-        enumerated.sort(key=lambda t: t[1]["date"])  # по дате
-        return list(reversed(enumerated))[:n]
+        with self._lock:
+            self._read()
+            tail = self._series.get(user_key, [])[-n:] if n > 0 else []
+            return [(i, self._by_id[i]) for _, i in reversed(tail)]
 
-    def update_weight_by_index(self, global_index: int, new_weight: float) -> None:
-        data = self._read()
-        if 0 <= global_index < len(data["weights"]):
-            old = data["weights"][global_index]
-            data["weights"][global_index]["weight"] = float(new_weight)
-            self._write(data)
-            log.info("Updated weight idx=%d (%s %s): %.3f -> %.3f",
-                     global_index, old["user_key"], old["date"], old["weight"], new_weight)
+    def update_weight(self, record_id: int, new_weight: float) -> None:
+        with self._lock:
+            self._read()
+            rec = self._by_id.get(record_id)
+            if rec is None:
+                return
+            old_weight = rec["weight"]
+            self._commit({"op": "update", "id": record_id, "weight": float(new_weight)})
+        log.info("Updated weight id=%d (%s %s): %.3f -> %.3f",
+                 record_id, rec["user_key"], rec["date"], old_weight, new_weight)
 
     def get_day_entry(self, user_key: str, day_iso: str) -> Optional[Tuple[int, dict]]:
-        """Найти запись конкретного дня и вернуть (глобальный_индекс, запись) или None."""
-        data = self._read()
-        for i, w in enumerate(data["weights"]):
-            if w["user_key"] == user_key and w["date"] == day_iso:
-                return i, w
-        return None
+        """Найти запись конкретного дня и вернуть (id_записи, запись) или None."""
+        with self._lock:
+            self._read()
+            record_id = self._by_day.get((user_key, day_iso))
+            return None if record_id is None else (record_id, self._by_id[record_id])
+
+    # --- Статистика ---
+    def get_user_stats(self, user_key: str, target: Optional[float] = None) -> dict:
+        """Средние, тренд и прогноз (см. stats.UserStats.summary); агрегаты ведутся инкрементально."""
+        with self._lock:
+            self._read()
+            return self._stats.get(user_key, self.get_user_series).summary(target)
+
+
+def shard_path(group_id: str = DEFAULT_GROUP) -> Path:
+    """
+    Файл шарда группы согласно config.STORAGE_BACKEND.
+    Основная группа живёт в прежних data.json / data.sqlite3, остальные — в GROUPS_DIR.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        return Path(SQLITE_PATH) if group_id == DEFAULT_GROUP else GROUPS_DIR / f"{group_id}.sqlite3"
+    if STORAGE_BACKEND != "json":
+        raise RuntimeError(f"Неизвестный STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return Path(DATA_PATH) if group_id == DEFAULT_GROUP else GROUPS_DIR / f"{group_id}.json"
+
+
+def create_storage(group_id: str = DEFAULT_GROUP, roster: Dict[str, str] = USERS):
+    """Хранилище (шард) группы согласно config.STORAGE_BACKEND, см. shard_path."""
+    path = shard_path(group_id)
+    if STORAGE_BACKEND == "sqlite":
+        from storage_sqlite import SqliteStorage
+        return SqliteStorage(path, roster=roster)
+    return Storage(path, roster=roster)
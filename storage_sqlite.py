@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from stats import StatsIndex
+from config import SQLITE_PATH, USERS
+
+log = logging.getLogger("storage")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_key    TEXT PRIMARY KEY,
+    name        TEXT NOT NULL,
+    telegram_id INTEGER,
+    remind_at   TEXT,
+    tz          TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_tg ON users(telegram_id);
+CREATE TABLE IF NOT EXISTS weights (
+    id       INTEGER PRIMARY KEY,
+    user_key TEXT NOT NULL,
+    date     TEXT NOT NULL,
+    weight   REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_weights_user_date ON weights(user_key, date);
+"""
+
+
+class SqliteStorage:
+    """
+    SQLite-хранилище с тем же интерфейсом, что и Storage.
+    Постоянный id записи веса — это id строки в таблице weights.
+    """
+    def __init__(self, path: Path = Path(SQLITE_PATH), roster: Dict[str, str] = USERS):
+        self.path = Path(path)
+        self.roster = dict(roster)  # роли группы: user_key → имя
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = StatsIndex()
+        self._stats_rev: Optional[int] = None   # ревизия БД, которой соответствуют агрегаты
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+            cols = {r["name"] for r in self._conn.execute("PRAGMA table_info(users)")}
+            for col in ("remind_at", "tz"):
+                if col not in cols:  # базы, созданные до появления напоминаний
+                    self._conn.execute(f"ALTER TABLE users ADD COLUMN {col} TEXT")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO users(user_key, name, telegram_id) VALUES (?, ?, NULL)",
+                self.roster.items(),
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta(key, value) VALUES ('start_date', ?)",
+                (date.today().isoformat(),),
+            )
+            self._conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('revision', 0)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _one(self, sql: str, args: tuple = ()) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchone()
+
+    def _all(self, sql: str, args: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def _bump_revision(self):
+        # вызывается внутри транзакции записи
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+        if self._stats_rev is not None:
+            # если БД менял кто-то ещё, ревизии разойдутся и агрегаты пересоберутся
+            self._stats_rev += 1
+
+    def get_revision(self) -> int:
+        """Номер версии данных: меняется при любой записи."""
+        return int(self._one("SELECT value FROM meta WHERE key = 'revision'")["value"])
+
+    @staticmethod
+    def _rec(row: sqlite3.Row) -> dict:
+        return {"id": row["id"], "user_key": row["user_key"], "date": row["date"], "weight": row["weight"]}
+
+    # --- Пользователи ---
+    def is_registered(self, tg_id: int) -> bool:
+        return self._one("SELECT 1 FROM users WHERE telegram_id = ?", (tg_id,)) is not None
+
+    def get_user_key_by_tg(self, tg_id: int) -> Optional[str]:
+        row = self._one("SELECT user_key FROM users WHERE telegram_id = ?", (tg_id,))
+        return row["user_key"] if row else None
+
+    def register(self, user_key: str, tg_id: int) -> Tuple[bool, str]:
+        if user_key not in self.roster:
+            return False, "Неизвестная роль."
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT telegram_id FROM users WHERE user_key = ?", (user_key,)
+            ).fetchone()
+            current_id = row["telegram_id"] if row else None
+            if current_id and current_id != tg_id:
+                return False, f"Роль «{self.roster[user_key]}» уже занята."
+            row = self._conn.execute(
+                "SELECT user_key FROM users WHERE telegram_id = ?", (tg_id,)
+            ).fetchone()
+            if row and row["user_key"] != user_key:
+                return False, f"Вы уже зарегистрированы как «{self.roster[row['user_key']]}»."
+            self._conn.execute(
+                "INSERT INTO users(user_key, name, telegram_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_key) DO UPDATE SET name = excluded.name, telegram_id = excluded.telegram_id",
+                (user_key, self.roster[user_key], tg_id),
+            )
+            self._bump_revision()
+        log.info("Registered user %s as %s (tg_id=%s)", tg_id, user_key, tg_id)
+        return True, f"Успех! Вы зарегистрированы как «{self.roster[user_key]}»."
+
+    def get_registered_users(self) -> Dict[str, Dict]:
+        rows = self._all(
+            "SELECT user_key, name, telegram_id, remind_at, tz FROM users WHERE telegram_id IS NOT NULL"
+        )
+        return {
+            r["user_key"]: {"telegram_id": r["telegram_id"], "name": r["name"],
+                            "remind_at": r["remind_at"], "tz": r["tz"]}
+            for r in rows
+        }
+
+    def set_reminder(self, user_key: str, remind_at: Optional[str], tz: Optional[str]) -> None:
+        """Время напоминания "ЧЧ:ММ" (или "off") и часовой пояс IANA; None — по умолчанию."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE users SET remind_at = ?, tz = ? WHERE user_key = ?", (remind_at, tz, user_key))
+            self._bump_revision()
+        log.info("Reminder for %s set to %s %s", user_key, remind_at, tz)
+
+    # --- Вес ---
+    def add_weight(self, user_key: str, weight: float, on_date: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Добавляет запись веса. Повтор за тот же день отсекает UNIQUE-индекс (user_key, date).
+        Возвращает (успех, сообщение).
+        """
+        on_date = on_date or date.today().isoformat()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO weights(user_key, date, weight) VALUES (?, ?, ?)",
+                    (user_key, on_date, float(weight)),
+                )
+                self._bump_revision()
+                self._stats.note_add(user_key, on_date, float(weight))
+        except sqlite3.IntegrityError:
+            return False, "На сегодня запись уже есть. Разрешена только одна запись в день."
+        log.info("Added weight: %s %s => %.3f", user_key, on_date, weight)
+        return True, "Записал! ✅"
+
+    def get_all_weights(self) -> List[dict]:
+        return [self._rec(r) for r in self._all("SELECT id, user_key, date, weight FROM weights ORDER BY id")]
+
+    def get_start_date(self) -> str:
+        return self._one("SELECT value FROM meta WHERE key = 'start_date'")["value"]
+
+    def get_user_series(self, user_key: str) -> List[dict]:
+        rows = self._all(
+            "SELECT id, user_key, date, weight FROM weights WHERE user_key = ? ORDER BY date", (user_key,)
+        )
+        return [self._rec(r) for r in rows]
+
+    def get_user_range(self, user_key: str, since: Optional[str] = None,
+                       until: Optional[str] = None) -> List[dict]:
+        """Записи пользователя с датой в [since, until] (ISO, границы включительно)."""
+        rows = self._all(
+            "SELECT id, user_key, date, weight FROM weights "
+            "WHERE user_key = ? AND date >= ? AND date <= ? ORDER BY date",
+            (user_key, since or "", until or "9999-12-31"),
+        )
+        return [self._rec(r) for r in rows]
+
+    def iter_weights(self, user_key: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None, chunk: int = 1000) -> Iterator[dict]:
+        """
+        Записи пачками по chunk (keyset-пагинация по id), без выборки всей таблицы в память.
+        С user_key — по возрастанию даты, без него — по id.
+        """
+        since, until = since or "", until or "9999-12-31"
+        if user_key is not None:
+            last = ("", 0)
+            while True:
+                rows = self._all(
+                    "SELECT id, user_key, date, weight FROM weights "
+                    "WHERE user_key = ? AND date >= ? AND date <= ? AND (date, id) > (?, ?) "
+                    "ORDER BY date, id LIMIT ?",
+                    (user_key, since, until, last[0], last[1], chunk),
+                )
+                yield from (self._rec(r) for r in rows)
+                if len(rows) < chunk:
+                    return
+                last = (rows[-1]["date"], rows[-1]["id"])
+        last_id = 0
+        while True:
+            rows = self._all(
+                "SELECT id, user_key, date, weight FROM weights "
+                "WHERE id > ? AND date >= ? AND date <= ? ORDER BY id LIMIT ?",
+                (last_id, since, until, chunk),
+            )
+            yield from (self._rec(r) for r in rows)
+            if len(rows) < chunk:
+                return
+            last_id = rows[-1]["id"]
+
+    def get_record(self, record_id: int) -> Optional[dict]:
+        row = self._one("SELECT id, user_key, date, weight FROM weights WHERE id = ?", (record_id,))
+        return self._rec(row) if row else None
+
+    # --- Редактирование последних записей ---
+    def get_user_last_entries(self, user_key: str, n: int = 4) -> List[Tuple[int, dict]]:
+        """Последние n записей пользователя (новые первыми) как список (id_записи, запись)."""
+        rows = self._all(
+            "SELECT id, user_key, date, weight FROM weights WHERE user_key = ? ORDER BY date DESC LIMIT ?",
+            (user_key, n),
+        )
+        return [(r["id"], self._rec(r)) for r in rows]
+
+    def update_weight(self, record_id: int, new_weight: float) -> None:
+        with self._lock, self._conn:
+            old = self._conn.execute(
+                "SELECT id, user_key, date, weight FROM weights WHERE id = ?", (record_id,)
+            ).fetchone()
+            if old is None:
+                return
+            self._conn.execute("UPDATE weights SET weight = ? WHERE id = ?", (float(new_weight), record_id))
+            self._bump_revision()
+            self._stats.note_update(old["user_key"], old["date"], float(new_weight))
+        log.info("Updated weight id=%d (%s %s): %.3f -> %.3f",
+                 record_id, old["user_key"], old["date"], old["weight"], new_weight)
+
+    def get_day_entry(self, user_key: str, day_iso: str) -> Optional[Tuple[int, dict]]:
+        """Найти запись конкретного дня и вернуть (id_записи, запись) или None."""
+        row = self._one(
+            "SELECT id, user_key, date, weight FROM weights WHERE user_key = ? AND date = ?",
+            (user_key, day_iso),
+        )
+        return (row["id"], self._rec(row)) if row else None
+
+    # --- Статистика ---
+    def get_user_stats(self, user_key: str, target: Optional[float] = None) -> dict:
+        """Средние, тренд и прогноз (см. stats.UserStats.summary); агрегаты ведутся инкрементально."""
+        with self._lock:
+            rev = int(self._conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()["value"])
+            if rev != self._stats_rev:
+                self._stats.clear()
+                self._stats_rev = rev
+            st = self._stats.get(user_key, lambda key: self._conn.execute(
+                "SELECT date, weight FROM weights WHERE user_key = ? ORDER BY date", (key,)
+            ))
+            return st.summary(target)
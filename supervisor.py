@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import signal
 import subprocess
 import time
 import json
@@ -18,13 +19,25 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN not set")
 
+from config import (
+    HEARTBEAT_PATH, HEARTBEAT_TIMEOUT, HEARTBEAT_GRACE, LOOP_LAG_LIMIT,
+    SUPERVISOR_STATS_PATH, CRASH_LOOP_WINDOW, CRASH_LOOP_MAX, DEFAULT_GROUP,
+)
+from startup import READY_FD_ENV
+
+from storage import create_storage
+
 BASE_DIR = Path(__file__).parent
-DATA_PATH = BASE_DIR / "data" / "data.json"
 
 def get_sergeant_chat_id() -> int | None:
+    # через хранилище, а не чтением data.json: свежие регистрации ещё лежат в журнале
     try:
-        data = json.loads(DATA_PATH.read_text(encoding="utf-8"))
-        s = data["users"].get("sergeant")
+        st = create_storage(DEFAULT_GROUP)
+        try:
+            s = st.get_registered_users().get("sergeant")
+        finally:
+            if hasattr(st, "close"):
+                st.close()
         tid = s.get("telegram_id") if s else None
         return int(tid) if tid else None
     except Exception as e:
@@ -38,7 +51,7 @@ def notify_sergeant(text: str):
         return
     try:
         url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        resp = requests.post(url, json={"chat_id": chat_id, "text": text})
+        resp = requests.post(url, json={"chat_id": chat_id, "text": text}, timeout=10)
         if resp.status_code != 200:
             log.warning("Notify failed: %s %s", resp.status_code, resp.text)
         else:
@@ -46,39 +59,292 @@ def notify_sergeant(text: str):
     except Exception:
         log.exception("Notify request failed")
 
-def run_bot_once() -> int:
-    log.info("Launching bot.py")
-    proc = subprocess.Popen(
-        [str(BASE_DIR / ".venv" / "bin" / "python"), "bot.py"],
-        stdout=open(BASE_DIR / "bot.out.log", "ab"),
-        stderr=open(BASE_DIR / "bot.err.log", "ab"),
-        cwd=str(BASE_DIR),
-    )
-    proc.wait()
-    return proc.returncode
+def read_heartbeat(pid: int) -> dict | None:
+    """Heartbeat процесса pid (см. loop_monitor.py) или None, если его ещё нет."""
+    try:
+        hb = json.loads(HEARTBEAT_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return hb if hb.get("pid") == pid else None
+
+def stop_bot(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        log.warning("bot.py ignores SIGTERM, killing")
+        proc.kill()
+        proc.wait()
+
+class BotProcess:
+    """
+    bot.py --standby: интерпретатор с уже импортированными aiogram/matplotlib,
+    ждёт "go" в stdin. О себе сообщает строками в пайп готовности (startup.notify_supervisor):
+    "ready" — импорты сделаны, "up" — после повышения бот принимает апдейты.
+    """
+    def __init__(self):
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        self.spawned_at = time.monotonic()
+        self.ready_at: float | None = None
+        self.promoted_at: float | None = None
+        self.up_at: float | None = None
+        self._lag_since: float | None = None
+        self._buf = b""
+        # у ребёнка свои копии дескрипторов логов — наши закрываем сразу, иначе каждый запуск их копит
+        with open(BASE_DIR / "bot.out.log", "ab") as out, open(BASE_DIR / "bot.err.log", "ab") as err:
+            self.proc = subprocess.Popen(
+                [str(BASE_DIR / ".venv" / "bin" / "python"), "bot.py", "--standby"],
+                stdin=subprocess.PIPE,
+                stdout=out,
+                stderr=err,
+                cwd=str(BASE_DIR),
+                env=dict(os.environ, **{READY_FD_ENV: str(write_fd)}),
+                pass_fds=(write_fd,),
+            )
+        os.close(write_fd)
+        self._fd: int | None = read_fd
+        log.info("Standby bot.py spawned (pid=%s)", self.proc.pid)
 
-def main():
-    backoff = 2
-    max_backoff = 60
-
-    while True:
-        rc = run_bot_once()
-        if rc == 0:
-            log.info("bot.py exited normally (rc=0)")
-            break
-
-        # Падение
-        log.error("bot.py crashed with rc=%s", rc)
-        if not first_start:
-            notify_sergeant("⚠️ Бот упал и перезапускается автоматически.")
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None and self.proc.poll() is None
+
+    def poll_pipe(self):
+        """Разобрать всё, что процесс успел написать в пайп готовности."""
+        while self._fd is not None:
+            try:
+                chunk = os.read(self._fd, 256)
+            except BlockingIOError:
+                return
+            if not chunk:
+                os.close(self._fd)
+                self._fd = None
+                return
+            self._buf += chunk
+            *lines, self._buf = self._buf.split(b"\n")
+            for line in lines:
+                now = time.monotonic()
+                if line == b"ready" and self.ready_at is None:
+                    self.ready_at = now
+                    log.info("Standby pid=%s ready in %.2fs", self.pid, now - self.spawned_at)
+                elif line == b"up" and self.up_at is None:
+                    self.up_at = now
+
+    def promote(self):
+        self.promoted_at = time.monotonic()
+        self.proc.stdin.write(b"go\n")
+        self.proc.stdin.close()
+        log.info("Standby pid=%s promoted", self.pid)
+
+    def hang_reason(self) -> str | None:
+        """Почему активный бот считается зависшим (по heartbeat из loop_monitor.py), или None."""
+        now = time.monotonic()
+        hb = read_heartbeat(self.pid)
+        if hb is None:
+            if now - self.promoted_at > HEARTBEAT_GRACE:
+                return f"no heartbeat {HEARTBEAT_GRACE:.0f}s after start"
+        elif time.time() - hb["ts"] > HEARTBEAT_TIMEOUT:
+            return f"heartbeat is {time.time() - hb['ts']:.0f}s old"
+        elif hb["lag"] > LOOP_LAG_LIMIT:
+            self._lag_since = self._lag_since or now
+            if now - self._lag_since > HEARTBEAT_TIMEOUT:
+                return f"event loop lag {hb['lag']:.1f}s for {now - self._lag_since:.0f}s"
+        else:
+            self._lag_since = None
+        return None
+
+    def stop(self):
+        if self.promoted_at is None and self.proc.poll() is None:
+            # резерв без "go" сам выходит с кодом 0, как только закрыт stdin
+            self.proc.stdin.close()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                stop_bot(self.proc)
+        elif self.proc.poll() is None:
+            stop_bot(self.proc)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class Supervisor:
+    """
+    Держит активный bot.py и тёплый резерв. Упал или завис активный — сразу повышается
+    резерв (простой — миллисекунды плюс запуск polling), и тут же готовится новый.
+    SIGHUP — плановый деплой: свежий резерв с новым кодом, мягкая остановка старого, повышение.
+    Backoff включается только при частых падениях (CRASH_LOOP_MAX за CRASH_LOOP_WINDOW).
+    """
+    TICK = 0.05
+    BACKOFF_START = 2
+    BACKOFF_MAX = 60
+
+    def __init__(self):
+        self.active: BotProcess | None = None
+        self.standby: BotProcess | None = None
+        self.stopping = False
+        self.deploy_requested = False
+        self.deploying = False
+        self.first_start = True
+        self.notice: str | None = None   # уведомление сержанту, уходит после повышения резерва
+        self.crashes: list[float] = []
+        self.hold_until = 0.0
+        self.backoff = self.BACKOFF_START
+        # перезапуск, который ждёт "up" от нового процесса: причина, rc, когда начался
+        self.pending: dict | None = {"reason": "start", "rc": None, "since": time.monotonic(), "warm": False}
+        self.stats = {"restarts": 0, "crashes": 0, "deploys": 0, "standby_failures": 0,
+                      "crash_loop": False, "last": None, "history": []}
+
+    # --- Сигналы ---
+    def on_hup(self, signum, frame):
+        self.deploy_requested = True
+
+    def on_term(self, signum, frame):
+        self.stopping = True
+
+    # --- Цикл ---
+    def run(self):
+        while not self.stopping:
+            self.tick()
+            time.sleep(self.TICK)
+        log.info("Supervisor stopping")
+        for p in (self.standby, self.active):
+            if p is not None:
+                p.stop()
+
+    def tick(self):
+        now = time.monotonic()
+        for p in (self.active, self.standby):
+            if p is not None:
+                p.poll_pipe()
+
+        if self.standby is not None and self.standby.proc.poll() is not None:
+            log.error("Standby bot.py died before promotion (rc=%s)", self.standby.proc.returncode)
+            self.stats["standby_failures"] += 1
+            self.standby.stop()
+            self.standby = None
+            self._note_crash(now)
+
+        if self.active is not None:
+            rc = self.active.proc.poll()
+            if rc == 0:
+                log.info("bot.py exited normally (rc=0)")
+                self.active.stop()
+                self.active = None
+                self.stopping = True
+                return
+            reason = None
+            if rc is not None:
+                reason = "crash"
+                log.error("bot.py crashed with rc=%s", rc)
+            elif (hang := self.active.hang_reason()) is not None:
+                reason = "hang"
+                log.error("bot.py is hung (%s), killing", hang)
+                # зависший loop SIGTERM не обработает — не ждём, резерв повышается сразу
+                self.active.proc.kill()
+                self.active.proc.wait()
+                rc = self.active.proc.returncode or 1
+            if reason:
+                self.active.stop()
+                self.active = None
+                self._note_crash(now)
+                self.stats["crashes"] += 1
+                self.pending = {"reason": reason, "rc": rc, "since": now,
+                                "warm": self.standby is not None and self.standby.ready}
+                if not self.first_start:
+                    self.notice = "⚠️ Бот упал и перезапускается автоматически."
+                else:
+                    self.notice = "⚠️ Бот запускается."
+                    log.info("First start cycle finished with crash")
+                self.first_start = False
+
+        if self.deploy_requested:
+            self.deploy_requested = False
+            log.info("Deploy requested: spawning a standby with the new code")
+            if self.standby is not None:
+                self.standby.stop()
+                self.standby = None
+            self.deploying = True
+
+        if self.standby is None and now >= self.hold_until:
+            self.standby = BotProcess()
+
+        if self.deploying and self.active is not None and self.standby is not None and self.standby.ready:
+            log.info("Deploy: stopping pid=%s", self.active.pid)
+            self.pending = {"reason": "deploy", "rc": None, "since": time.monotonic(), "warm": True}
+            self.active.stop()
+            self.active = None
+            self.stats["deploys"] += 1
+        if self.active is None:
+            self.deploying = False
+
+        if self.active is None and self.standby is not None and self.standby.ready and now >= self.hold_until:
+            self.active, self.standby = self.standby, None
+            self.active.promote()
+            if self.notice:
+                notify_sergeant(self.notice)
+                self.notice = None
+
+        if self.pending is not None and self.active is not None and self.active.up_at is not None:
+            self._record_restart()
+
+    def _note_crash(self, now: float):
+        """Учёт падений за окно; при цикле падений — пауза перед следующим запуском."""
+        self.crashes = [t for t in self.crashes if now - t < CRASH_LOOP_WINDOW] + [now]
+        if len(self.crashes) >= CRASH_LOOP_MAX:
+            self.hold_until = now + self.backoff
+            log.error("Crash loop: %d crashes in %.0fs, next start in %ds",
+                      len(self.crashes), CRASH_LOOP_WINDOW, self.backoff)
+            self.backoff = min(self.BACKOFF_MAX, self.backoff * 2)  # экспоненциальная задержка
+            self.stats["crash_loop"] = True
         else:
-            notify_sergeant("⚠️ Бот запускается.")
-            # Если это первый старт после ребута — просто отметим
-            log.info("First start cycle finished with crash (no notify)")
-        first_start = False
+            self.backoff = self.BACKOFF_START
+            self.stats["crash_loop"] = False
+
+    def _record_restart(self):
+        p, pending = self.active, self.pending
+        self.pending = None
+        entry = {
+            "reason": pending["reason"],
+            "rc": pending["rc"],
+            "pid": p.pid,
+            "warm": pending["warm"],
+            # от обнаружения падения (или начала деплоя) до "up" нового процесса
+            "restart_to_ready_ms": round((p.up_at - pending["since"]) * 1000, 1),
+            # от "go" до "up": сколько стоит сам запуск уже импортированного бота
+            "promote_to_ready_ms": round((p.up_at - p.promoted_at) * 1000, 1),
+            "ts": round(time.time(), 3),
+        }
+        if pending["reason"] != "start":
+            self.stats["restarts"] += 1
+        self.stats["last"] = entry
+        self.stats["history"] = (self.stats["history"] + [entry])[-20:]
+        self.stats["crashes_in_window"] = len(self.crashes)
+        log.info("bot.py pid=%s up after %s: restart-to-ready %.0fms (promote-to-ready %.0fms), "
+                 "%d crashes in last %.0fs",
+                 p.pid, entry["reason"], entry["restart_to_ready_ms"], entry["promote_to_ready_ms"],
+                 len(self.crashes), CRASH_LOOP_WINDOW)
+        self._write_stats()
 
-        time.sleep(backoff)
-        backoff = min(max_backoff, backoff * 2)  # экспоненциальная задержка
+    def _write_stats(self):
+        try:
+            SUPERVISOR_STATS_PATH.parent.mkdir(parents=True, exist_ok=True)
+            tmp = SUPERVISOR_STATS_PATH.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.stats, indent=2), encoding="utf-8")
+            os.replace(tmp, SUPERVISOR_STATS_PATH)
+        except OSError as e:
+            log.warning("Cannot write supervisor stats: %s", e)
+
+def main():
+    sup = Supervisor()
+    signal.signal(signal.SIGHUP, sup.on_hup)
+    signal.signal(signal.SIGTERM, sup.on_term)
+    signal.signal(signal.SIGINT, sup.on_term)
+    sup.run()
 
 if __name__ == "__main__":
     main()
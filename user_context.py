@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+
+from groups import GroupRegistry
+
+NOT_REGISTERED_TEXT = "Сначала зарегистрируйтесь: /start"
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Один раз на апдейт определяет, кто пишет, и кладёт groups.UserContext
+    (или None) в data["user_ctx"] — хэндлеры получают его аргументом user_ctx.
+    Хэндлеры с флагом registered (flags={"registered": True}) незарегистрированным
+    не вызываются: им отвечаем здесь же и сбрасываем состояние FSM.
+    """
+    def __init__(self, groups: GroupRegistry):
+        self.groups = groups
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any,
+                       data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        ctx = await self.groups.resolve(user.id) if user else None
+        data["user_ctx"] = ctx
+        if ctx is None and get_flag(data, "registered"):
+            state = data.get("state")
+            if state is not None:
+                await state.clear()
+            if isinstance(event, CallbackQuery):
+                await event.answer(NOT_REGISTERED_TEXT, show_alert=True)
+            else:
+                await event.answer(NOT_REGISTERED_TEXT)
+            return None
+        return await handler(event, data)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from typing import Callable
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from metrics import metrics_view
+
+log = logging.getLogger("http")
+
+
+async def health_view(request: web.Request) -> web.Response:
+    info = request.app["health"]()
+    return web.json_response(info, status=200 if info.get("ok") else 503)
+
+
+def build_app(health: Callable[[], dict]) -> web.Application:
+    """
+    Один aiohttp-сервер на всё: /health, /metrics и (в режиме webhook) приём апдейтов.
+    health() возвращает словарь состояния; ключ "ok" определяет код ответа.
+    """
+    app = web.Application()
+    app["health"] = health
+    app.router.add_get("/health", health_view)
+    app.router.add_get("/metrics", metrics_view)
+    return app
+
+
+class WebhookHandler(SimpleRequestHandler):
+    """
+    SimpleRequestHandler, который перед остановкой бота перестаёт брать апдейты
+    (503 — Telegram повторит доставку позже) и дожидается уже начатых.
+    """
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str):
+        super().__init__(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=True)
+        self.accepting = True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.accepting:
+            return web.Response(status=503)
+        return await super().handle(request)
+
+    async def drain(self, timeout: float = 10):
+        self.accepting = False
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            log.info("Waiting for %d webhook updates in progress", len(tasks))
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                log.warning("%d webhook updates still running after %.0fs", len(pending), timeout)
+
+
+def attach_webhook(app: web.Application, dp: Dispatcher, bot: Bot, path: str, secret: str) -> WebhookHandler:
+    """
+    Апдейты от Telegram на path. Запросы без верного
+    X-Telegram-Bot-Api-Secret-Token отклоняются (401). Ответ уходит сразу,
+    апдейт обрабатывается в фоне — Telegram не ждёт хэндлер.
+    """
+    handler = WebhookHandler(dp, bot, secret)
+    handler.register(app, path=path)
+    return handler
+
+
+async def start_http(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("HTTP server on http://%s:%d", host, port)
+    return runner